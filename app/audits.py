@@ -0,0 +1,159 @@
+import os
+import json
+import orjson
+from sqlalchemy.orm import Session
+from . import models, results_store
+
+# NaN -> null, numpy scalars allowed, int cluster ids as keys
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+NDJSON_BATCH_ROWS = 10000
+
+
+def save_audit(db: Session, user_id: int, filename: str, outcome: dict, commit: bool = True):
+    """
+    Writes the Audit row for a finished analysis (see workers.analyze_csv for `outcome`).
+    commit=False only flushes, for callers that commit it together with their own changes.
+    """
+    new_audit = _add_audit(db, user_id, filename, outcome)
+    if outcome.get("centroids") is not None:
+        _remember_centroids(db, user_id, new_audit.id, outcome["centroids"])
+    if commit:
+        db.commit()
+        db.refresh(new_audit)
+    return new_audit
+
+
+def save_audits(db: Session, user_id: int, items):
+    """
+    Bulk version of save_audit: all (filename, outcome) pairs go in with a single commit.
+    The last file's centroids become the user's warm-start model. Returns the new audit ids.
+    """
+    new_audits = [_add_audit(db, user_id, filename, outcome) for filename, outcome in items]
+    for new_audit, (_, outcome) in reversed(list(zip(new_audits, items))):
+        if outcome.get("centroids") is not None:
+            _remember_centroids(db, user_id, new_audit.id, outcome["centroids"])
+            break
+    # Read before the commit expires them
+    audit_ids = [new_audit.id for new_audit in new_audits]
+    db.commit()
+    return audit_ids
+
+
+def _add_audit(db: Session, user_id: int, filename: str, outcome: dict):
+    new_audit = models.Audit(
+        filename=filename,
+        total_spend=outcome["total_spend"],
+        potential_savings=outcome["savings"],
+        user_id=user_id
+    )
+    db.add(new_audit)
+    db.flush()
+
+    # Remember where the labeled rows went so the audit can be reopened without re-clustering
+    summary = {k: v for k, v in outcome["analysis"].items() if k != "detailed_results"}
+    db.add(models.AuditResultSet(
+        audit_id=new_audit.id,
+        results_path=outcome["results_path"],
+        row_count=outcome["analysis"].get("row_count"),
+        analysis_summary=json.dumps(summary, default=float)
+    ))
+    return new_audit
+
+
+def _remember_centroids(db: Session, user_id: int, audit_id: int, centroids):
+    user_model = db.get(models.UserModel, user_id) or models.UserModel(user_id=user_id)
+    user_model.audit_id = audit_id
+    user_model.n_clusters = len(centroids)
+    user_model.centroids = json.dumps(centroids)
+    db.add(user_model)
+
+
+def load_centroids(db: Session, user_id: int):
+    """The user's last fitted centroids (list of lists), or None before their first audit."""
+    user_model = db.get(models.UserModel, user_id)
+    return json.loads(user_model.centroids) if user_model else None
+
+
+def delete_audit(db: Session, audit: models.Audit):
+    """Removes the audit and its stored results (the file goes once no other audit shares it)."""
+    result_set = db.query(models.AuditResultSet).filter(models.AuditResultSet.audit_id == audit.id).first()
+    if result_set:
+        db.delete(result_set)
+    # The user keeps their warm-start model, it just no longer points at this audit
+    db.query(models.UserModel).filter(models.UserModel.audit_id == audit.id).update({"audit_id": None})
+    # A job's result file is a full copy of the rows, it goes with the audit
+    job_results = [
+        path for (path,) in db.query(models.AuditJob.result_path).filter(models.AuditJob.audit_id == audit.id)
+        if path
+    ]
+    db.query(models.AuditJob).filter(models.AuditJob.audit_id == audit.id).update(
+        {"audit_id": None, "result_path": None}
+    )
+    db.delete(audit)
+    db.commit()
+
+    for path in job_results:
+        if os.path.exists(path):
+            os.remove(path)
+
+    if result_set:
+        path = result_set.results_path
+        results_store.remove_if_unused(path, lambda: db.query(models.AuditResultSet).filter(
+            models.AuditResultSet.results_path == path
+        ).first() is not None)
+
+
+def dumps(payload):
+    return orjson.dumps(payload, option=ORJSON_OPTIONS)
+
+
+def response_header(audit: models.Audit, outcome: dict):
+    """Everything in the upload payload except the row data."""
+    return {
+        "status": "success",
+        "database_id": audit.id,
+        "analysis": {k: v for k, v in outcome["analysis"].items() if k != "detailed_results"},
+        "summary": {"total_spend": outcome["total_spend"], "savings": outcome["savings"]}
+    }
+
+
+def detailed_results(outcome: dict, fmt: str = "json"):
+    """
+    Row data for the response: one dict per row, or {column: [values]} for fmt="columnar".
+    The standard engine keeps its rows only in the Parquet file; the streaming engine carries a preview.
+    """
+    rows = outcome["analysis"].get("detailed_results")
+    if rows is None:
+        if fmt == "columnar":
+            return results_store.read_columns(outcome["results_path"])
+        return results_store.read_records(outcome["results_path"])
+    if fmt == "columnar":
+        columns = rows[0].keys() if rows else []
+        return {c: [row[c] for row in rows] for c in columns}
+    return rows
+
+
+def build_response(audit: models.Audit, outcome: dict, fmt: str = "json"):
+    """The payload /upload-logistics returns (and the job result endpoint serves)."""
+    payload = response_header(audit, outcome)
+    payload["analysis"]["detailed_results"] = detailed_results(outcome, fmt)
+    return payload
+
+
+def encode_response(audit: models.Audit, outcome: dict, fmt: str = "json", **extra):
+    """build_response + dumps in one call (both CPU-bound on big uploads), for running in a thread."""
+    payload = build_response(audit, outcome, fmt)
+    payload.update(extra)
+    return dumps(payload)
+
+
+def iter_ndjson(header: dict, outcome: dict):
+    """First line: the header (status, ids, insights, summary). Then one JSON object per row, in batches."""
+    yield dumps(header) + b"\n"
+    rows = outcome["analysis"].get("detailed_results")
+    if rows is None:
+        batches = results_store.iter_record_batches(outcome["results_path"], NDJSON_BATCH_ROWS)
+    else:
+        batches = (rows[i:i + NDJSON_BATCH_ROWS] for i in range(0, len(rows), NDJSON_BATCH_ROWS))
+    for batch in batches:
+        yield b"".join(dumps(row) + b"\n" for row in batch)
@@ -0,0 +1,60 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from . import metrics
+
+# --- CONFIGURATION ---
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "32"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "21600"))
+# Results bigger than this stay out of the cache so a few huge files can't eat the RAM
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "200000"))
+
+
+class ResultCache:
+    """Small LRU + TTL map from upload fingerprint to the finished analysis."""
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                metrics.result_cache_misses.inc()
+                return None
+            self._entries.move_to_end(key)
+            metrics.result_cache_hits.inc()
+            return entry[1]
+
+    def put(self, key, outcome):
+        if self.max_entries <= 0:
+            return
+        if outcome["analysis"].get("row_count", 0) > RESULT_CACHE_MAX_ROWS:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), outcome)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+results = ResultCache()
+
+
+def fingerprint(path, params):
+    """sha256 of the uploaded file plus the model settings used."""
+    digest = hashlib.sha256(repr(params).encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
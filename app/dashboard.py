@@ -3,7 +3,15 @@ import pandas as pd
 import plotly.express as px
 import requests
 import io
+import os
+import json
+import hashlib
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
+# How long a fetched history view is reused across reruns (uploads/renames/deletes refresh it sooner)
+HISTORY_CACHE_TTL_SECONDS = int(os.getenv("HISTORY_CACHE_TTL_SECONDS", "60"))
 
 # --- 1. SESSION STATE INITIALIZATION ---
 if 'logged_in' not in st.session_state:
@@ -12,6 +20,8 @@ if 'username' not in st.session_state:
     st.session_state.username = ""
 if 'token' not in st.session_state:
     st.session_state.token = None
+if 'data_version' not in st.session_state:
+    st.session_state.data_version = 0  # bumped on every change, so cached history is re-fetched
 
 st.set_page_config(page_title="AdOptimizer AI", layout="wide", page_icon="🎯")
 
@@ -34,6 +44,76 @@ def get_auth_header():
     """Returns the security header needed for the Backend to identify the user."""
     return {"Authorization": f"Bearer {st.session_state.token}"}
 
+def get_http():
+    """One keep-alive connection pool per browser session, instead of a new connection per call."""
+    if 'http' not in st.session_state:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        st.session_state.http = session
+    return st.session_state.http
+
+def data_changed():
+    """Call after upload / rename / delete: the next history read skips the cache."""
+    st.session_state.data_version += 1
+
+@st.cache_data(ttl=HISTORY_CACHE_TTL_SECONDS, max_entries=256, show_spinner=False)
+def fetch_filter_details(_http, token, min_savings_target, data_version):
+    """
+    Cached per (token, target, data_version); _http is skipped when hashing.
+    Returns (status_code, json) so errors aren't mistaken for an empty history.
+    """
+    res = _http.get(
+        f"{BACKEND_URL}/filter-details",
+        params={"min_savings_target": min_savings_target},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    return res.status_code, (res.json() if res.status_code == 200 else None)
+
+def upload_key(uploaded_file):
+    """Identifies one selected file, so the same upload isn't re-sent on every rerun."""
+    return getattr(uploaded_file, "file_id", None) or hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+def analyze_upload(uploaded_file):
+    """Posts the file once and keeps the outcome (or the error) in session state."""
+    files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "text/csv")}
+    # NDJSON: a header line, then one line per ad, read as it arrives
+    response = get_http().post(
+        f"{BACKEND_URL}/upload-logistics",
+        params={"format": "ndjson"},
+        files=files,
+        headers=get_auth_header(),
+        stream=True
+    )
+    if response.status_code != 200:
+        return {"error": f"Error {response.status_code}: {response.text}"}
+
+    lines = response.iter_lines()
+    full_payload = json.loads(next(lines))
+    results_df = read_ndjson_rows(lines, expected_rows=full_payload["analysis"].get("row_count"))
+    data_changed()
+    return {"payload": full_payload, "results_df": results_df}
+
+def read_ndjson_rows(lines, expected_rows=None, batch_size=10000):
+    """Builds the results DataFrame batch by batch from NDJSON lines, with a progress bar."""
+    progress = st.progress(0.0, text="Receiving analyzed ads...")
+    frames, batch = [], []
+    for line in lines:
+        if not line:
+            continue
+        batch.append(json.loads(line))
+        if len(batch) == batch_size:
+            frames.append(pd.DataFrame(batch))
+            batch = []
+            if expected_rows:
+                received = sum(len(f) for f in frames)
+                progress.progress(min(received / expected_rows, 1.0), text=f"Received {received:,} ads...")
+    if batch:
+        frames.append(pd.DataFrame(batch))
+    progress.empty()
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
 def show_auth_page():
     st.title("🔐 AdOptimizer Secure Access")
     st.write("Please log in to access your SQL-backed Logistics Module.")
@@ -47,7 +127,7 @@ def show_auth_page():
         if st.button("Sign In", type="primary", use_container_width=True):
             payload = {"username": user, "password": pwd}
             try:
-                res = requests.post("http://backend:8000/login", data=payload)
+                res = get_http().post(f"{BACKEND_URL}/login", data=payload)
                 if res.status_code == 200:
                     data = res.json()
                     st.session_state.logged_in = True
@@ -67,7 +147,7 @@ def show_auth_page():
         if st.button("Register Account", use_container_width=True):
             payload = {"username": new_user, "password": new_pass}
             try:
-                res = requests.post("http://backend:8000/signup", json=payload)
+                res = get_http().post(f"{BACKEND_URL}/signup", json=payload)
                 data = res.json()
                 if res.status_code == 200 and data.get("status") == "success":
                     st.success("Account created! You can now switch to the Login tab.")
@@ -87,6 +167,8 @@ with st.sidebar:
     st.write(f"✅ **Logged in as:** {st.session_state.username}")
     
     if st.button("🚪 Logout", use_container_width=True):
+        if 'http' in st.session_state:
+            st.session_state.http.close()
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
@@ -102,45 +184,50 @@ with main_tab:
     uploaded_file = st.file_uploader("Upload Ad CSV", type="csv")
 
     if uploaded_file:
-        with st.spinner('AI Clustering & Auto-Saving...'):
-            try:
-                files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "text/csv")}
-                response = requests.post(
-                    "http://backend:8000/upload-logistics", 
-                    files=files, 
-                    headers=get_auth_header()
-                )
-                
-                if response.status_code == 200:
-                    full_payload = response.json()
-                    results = full_payload["analysis"]
-                    results_df = pd.DataFrame(results["detailed_results"])
-                    
-                    st.success(f"File analyzed and saved! (DB ID: {full_payload.get('database_id')})")
-
-                    m1, m2, m3, m4, m5 = st.columns(5)
-                    m1.metric("Ads Analyzed", f"{len(results_df):,}")
-                    m2.metric("Avg CPC", f"${results_df['CPC'].mean():.2f}")
-                    m3.metric("Avg CTR", f"{results_df['CTR'].mean():.3%}")
-                    m4.metric("AI Confidence", f"{results['model_accuracy_score']:.1%}")
-                    m5.metric("Waste Found", f"${full_payload['summary']['savings']:,.2f}")
-
-                    st.divider()
-
-                    fig = px.scatter(results_df, x="Spend", y="CPC", color="ad_group", 
-                                   template="plotly_white", title="Spend vs Cost-Per-Click")
-                    st.plotly_chart(fig, use_container_width=True)
-
-                    with audit_tab:
-                        st.subheader("Waste Analysis (High Risk Clusters)")
-                        risky_ids = [int(gid) for gid, info in results["group_insights"].items() if info["status"] == "Risky"]
-                        st.dataframe(results_df[results_df['ad_group'].isin(risky_ids)], use_container_width=True)
-                
-                else:
-                    st.error(f"Error {response.status_code}: {response.text}")
+        # Streamlit reruns the script on every click; only a newly selected file goes to the backend
+        key = upload_key(uploaded_file)
+        if st.session_state.get("last_upload", {}).get("key") != key:
+            with st.spinner('AI Clustering & Auto-Saving...'):
+                try:
+                    outcome = analyze_upload(uploaded_file)
+                except Exception as e:
+                    outcome = {"error": f"Analysis failed: {e}"}
+                st.session_state.last_upload = {"key": key, **outcome}
 
-            except Exception as e:
-                st.error(f"Analysis failed: {e}")
+        last_upload = st.session_state.last_upload
+        if "error" in last_upload:
+            st.error(last_upload["error"])
+        else:
+            full_payload = last_upload["payload"]
+            results = full_payload["analysis"]
+            results_df = last_upload["results_df"]
+
+            st.success(f"File analyzed and saved! (DB ID: {full_payload.get('database_id')})")
+
+            m1, m2, m3, m4, m5 = st.columns(5)
+            m1.metric("Ads Analyzed", f"{results.get('row_count', len(results_df)):,}")
+            m2.metric("Avg CPC", f"${results_df['CPC'].mean():.2f}")
+            m3.metric("Avg CTR", f"{results_df['CTR'].mean():.3%}")
+            m4.metric(
+                "AI Confidence", f"{results['model_accuracy_score']:.1%}",
+                help=f"{results.get('model_accuracy_method', 'exact')} silhouette on "
+                     f"{results.get('model_accuracy_sample_size', len(results_df)):,} rows"
+            )
+            m5.metric("Waste Found", f"${full_payload['summary']['savings']:,.2f}")
+
+            if results.get("detailed_results_truncated"):
+                st.caption(f"Large export: charts below use a {len(results_df):,}-row sample.")
+
+            st.divider()
+
+            fig = px.scatter(results_df, x="Spend", y="CPC", color="ad_group", 
+                           template="plotly_white", title="Spend vs Cost-Per-Click")
+            st.plotly_chart(fig, use_container_width=True)
+
+            with audit_tab:
+                st.subheader("Waste Analysis (High Risk Clusters)")
+                risky_ids = [int(gid) for gid, info in results["group_insights"].items() if info["status"] == "Risky"]
+                st.dataframe(results_df[results_df['ad_group'].isin(risky_ids)], use_container_width=True)
 
 with history_tab:
     st.subheader(f"Personal Audit History for {st.session_state.username}")
@@ -152,24 +239,23 @@ with history_tab:
     st.divider()
 
     try:
-        h_res = requests.get("http://backend:8000/history", headers=get_auth_header())
+        # One request: the backend classifies every audit against the target (newest first),
+        # reused across reruns until the TTL runs out or this user changes something
+        status_code, history_data = fetch_filter_details(
+            get_http(), st.session_state.token, target_threshold, st.session_state.data_version
+        )
         
-        if h_res.status_code == 200:
-            history_data = h_res.json()
+        if status_code == 200:
             if history_data:
-                for item in reversed(history_data):
-                    # Fundamental: Call the Backend Filter Endpoint for each audit
-                    f_url = f"http://backend:8000/filter-details/{item['id']}?min_savings_target={target_threshold}"
-                    f_res = requests.get(f_url, headers=get_auth_header()).json()
-                    
+                for item in history_data:
                     # Determine styling based on backend "status"
-                    is_high = f_res.get("status") == "high_priority"
+                    is_high = item.get("status") == "high_priority"
                     border_color = "#ff4b4b" if is_high else "#e9ecef"
                     
                     with st.container(border=True):
                         # Visual Cue: Red Label for High Risk
                         if is_high:
-                            st.error(f"🔥 {f_res['message']}")
+                            st.error(f"🔥 {item['message']}")
                         
                         col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
                         
@@ -181,22 +267,25 @@ with history_tab:
                             with st.expander("✏️ Rename"):
                                 new_name = st.text_input("New Name", value=item['filename'], key=f"input_{item['id']}")
                                 if st.button("Confirm Rename", key=f"ren_{item['id']}"):
-                                    ren_res = requests.patch(
-                                        f"http://backend:8000/rename-audit/{item['id']}?new_name={new_name}",
+                                    ren_res = get_http().patch(
+                                        f"{BACKEND_URL}/rename-audit/{item['id']}",
+                                        params={"new_name": new_name},
                                         headers=get_auth_header()
                                     )
                                     if ren_res.status_code == 200:
+                                        data_changed()
                                         st.rerun()
 
                         col2.metric("Waste", f"${item['potential_savings']:,.2f}")
                         col3.metric("Total Spend", f"${item['total_spend']:,.2f}")
                         
                         if col4.button("🗑️ Delete", key=f"del_{item['id']}", use_container_width=True):
-                            del_res = requests.delete(
-                                f"http://backend:8000/delete-audit/{item['id']}", 
+                            del_res = get_http().delete(
+                                f"{BACKEND_URL}/delete-audit/{item['id']}", 
                                 headers=get_auth_header()
                             )
                             if del_res.status_code == 200:
+                                data_changed()
                                 st.rerun()
             else:
                 st.info("No saved audits yet.")
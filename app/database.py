@@ -1,11 +1,46 @@
-from sqlalchemy import create_engine
+import os
+import asyncio
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from . import metrics
 
 #this creates actual file on cpu
-SQLALCHEMY_DATABASE_URL = "sqlite:///./adoptimizer.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./adoptimizer.db")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# --- TUNING (all optional) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# 1 = create missing tables/indexes on startup; set 0 when `python -m app.migrate` runs as a deploy step
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+
+def _engine_options(url: str):
+    options = {}
+    if IS_SQLITE:
+        options["connect_args"] = {"check_same_thread": False}
+    # In-memory SQLite uses a single shared connection, pool sizing doesn't apply there
+    if ":memory:" not in url:
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers work while an upload commits; busy_timeout waits instead of 'database is locked'."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **_engine_options(SQLALCHEMY_DATABASE_URL))
+if IS_SQLITE:
+    event.listen(engine, "connect", _sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -13,10 +48,95 @@ Base = declarative_base()
 #This is helping function to get db session
 #Helper for fast api
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    # Times the whole checkout -> close span, i.e. how long a request holds its connection
+    with metrics.timed("db_session"):
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+        #plumbing
+
+
+async def run_in_session(fn, *args):
+    """
+    Runs fn(db, *args) with its own Session on a worker thread. For async endpoints that await
+    around their DB work (bcrypt, the analysis pool): a sync Session must never run on the event loop.
+    Whatever fn returns must already be loaded, the Session is closed afterwards.
+    """
+    def call():
+        with metrics.timed("db_session"):
+            db = SessionLocal()
+            try:
+                return fn(db, *args)
+            finally:
+                db.close()
+    return await asyncio.to_thread(call)
+
+
+# --- SCHEMA SETUP ---
+def init_schema():
+    """Creates missing tables, then missing indexes (create_all skips tables that already exist)."""
+    from . import models  # noqa: F401  (registers every table on Base)
+
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def _add_missing_columns():
+    """create_all never alters an existing table, so columns added to a model later (all nullable) go in here."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+# --- ASYNC PATH (aiosqlite / asyncpg) ---
+# Endpoints that only read use this so their queries never block the event loop.
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+_async_engine = None
+_async_session_factory = None
+
+
+def async_database_url(url: str = SQLALCHEMY_DATABASE_URL):
+    """sqlite:///x.db -> sqlite+aiosqlite:///x.db, postgresql://... -> postgresql+asyncpg://..."""
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+", 1)[0]  # drop any sync driver, e.g. postgresql+psycopg2
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}://{rest}"
+
+
+def get_async_engine():
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        url = os.getenv("ASYNC_DATABASE_URL") or async_database_url()
+        options = _engine_options(url)
+        options.pop("connect_args", None)
+        _async_engine = create_async_engine(url, **options)
+        if IS_SQLITE:
+            event.listen(_async_engine.sync_engine, "connect", _sqlite_pragmas)
+        _async_session_factory = async_sessionmaker(_async_engine, expire_on_commit=False)
+    return _async_engine
+
+
+async def get_async_db():
+    get_async_engine()
+    with metrics.timed("db_session_async"):
+        async with _async_session_factory() as db:
+            yield db
+
 
-        #plumbing
\ No newline at end of file
+async def dispose_engines():
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    engine.dispose()
@@ -0,0 +1,272 @@
+import os
+import uuid
+import shutil
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+
+from . import models, workers, audits, metrics
+from .database import SessionLocal
+
+# --- CONFIGURATION ---
+JOB_STORAGE_DIR = os.getenv("JOB_STORAGE_DIR", "./job_data")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", str(workers.ANALYSIS_WORKERS)))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# Running jobs whose owner hasn't heartbeated for this long are re-queued (the owner is presumed dead)
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+# Identifies this process's claims, so several API containers can share one job table
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+_wakeup = None
+
+
+def _wake():
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+# --- 1. ENQUEUE ---
+def enqueue(db, user_id: int, filename: str, spooled_path: str, auto_k: bool = False, warm_start: bool = False):
+    """Moves the spooled upload into the job dir and queues it. Returns the new AuditJob."""
+    os.makedirs(JOB_STORAGE_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    upload_path = os.path.join(JOB_STORAGE_DIR, f"{job_id}.csv")
+    shutil.move(spooled_path, upload_path)
+
+    job = models.AuditJob(
+        id=job_id, filename=filename, upload_path=upload_path, user_id=user_id,
+        auto_k=auto_k, warm_start=warm_start
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _wake()
+    return job
+
+
+def _owned(db, job_id: str):
+    """This process's running claim on job_id (empty once the job was re-queued or finished elsewhere)."""
+    return db.query(models.AuditJob).filter(
+        models.AuditJob.id == job_id,
+        models.AuditJob.worker_id == WORKER_ID,
+        models.AuditJob.status == "running"
+    )
+
+
+def _update(job_id: str, **fields):
+    """Updates a job this process still owns. Returns False if it doesn't any more."""
+    db = SessionLocal()
+    try:
+        updated = _owned(db, job_id).update(fields, synchronize_session=False)
+        db.commit()
+        return updated == 1
+    finally:
+        db.close()
+
+
+# --- 2. PROCESS ONE JOB ---
+# Every DB / file call below is sync and goes through asyncio.to_thread, so a busy SQLite
+# (busy_timeout) or a slow disk never stalls the event loop
+def _load(job_id: str):
+    db = SessionLocal()
+    try:
+        job = db.query(models.AuditJob).filter(models.AuditJob.id == job_id).first()
+        # Read at run time so a job queued behind another upload starts from the newer model
+        init_centroids = audits.load_centroids(db, job.user_id) if job.warm_start else None
+        return job.upload_path, job.user_id, job.filename, bool(job.auto_k), init_centroids
+    finally:
+        db.close()
+
+
+async def _process(job_id: str):
+    upload_path, user_id, filename, auto_k, init_centroids = await asyncio.to_thread(_load, job_id)
+
+    try:
+        outcome, _ = await workers.run_analysis(upload_path, auto_k, init_centroids)
+    except HTTPException as e:
+        if e.status_code == 503:
+            # Pool is busy with direct uploads, back off and put it back in line
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            await asyncio.to_thread(_update, job_id, status="queued", progress=0, worker_id=None)
+            return
+        raise
+
+    if "error" in outcome:
+        if await asyncio.to_thread(_update, job_id, status="failed", error=outcome["error"], finished_at=datetime.utcnow()):
+            await asyncio.to_thread(_discard, upload_path)
+        return
+    if not await asyncio.to_thread(_update, job_id, progress=80):
+        return  # Re-queued as stale meanwhile; whoever has it now will finish it
+
+    # The result file holds every row of the upload, so build and write it off the event loop
+    if await asyncio.to_thread(_finish, job_id, user_id, filename, outcome):
+        # The CSV is no longer needed once the result is on disk
+        await asyncio.to_thread(_discard, upload_path)
+
+
+def result_path_for(job_id: str):
+    return os.path.join(JOB_STORAGE_DIR, f"{job_id}.result.json")
+
+
+def _finish(job_id: str, user_id: int, filename: str, outcome: dict):
+    """
+    Saves the audit, writes the result file and marks the job done. The audit is linked to the
+    job in the same transaction that creates it, and only while this process still owns the job,
+    so a job that also ran elsewhere (after a stale re-queue) can't produce a second Audit.
+    Returns False if this process no longer owns the job.
+    """
+    db = SessionLocal()
+    try:
+        if _owned(db, job_id).filter(models.AuditJob.audit_id.is_(None)).update(
+            {"progress": 90}, synchronize_session=False
+        ) != 1:
+            db.rollback()
+            return False
+        new_audit = audits.save_audit(db, user_id, filename, outcome, commit=False)
+        db.query(models.AuditJob).filter(models.AuditJob.id == job_id).update(
+            {"audit_id": new_audit.id}, synchronize_session=False
+        )
+        db.commit()
+
+        result_path = result_path_for(job_id)
+        with open(result_path, "wb") as f:
+            f.write(audits.dumps(audits.build_response(new_audit, outcome)))
+        _owned(db, job_id).update(
+            {"status": "done", "progress": 100, "result_path": result_path, "finished_at": datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def _discard(path: str):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _discard_job_files(job_id: str):
+    """Removes a job's upload and (possibly half-written) result file."""
+    db = SessionLocal()
+    try:
+        job = db.query(models.AuditJob).filter(models.AuditJob.id == job_id).first()
+        upload_path = job.upload_path if job else None
+    finally:
+        db.close()
+    _discard(upload_path)
+    _discard(result_path_for(job_id))
+
+
+async def _run_guarded(job_id: str):
+    try:
+        await _process(job_id)
+    except Exception as e:
+        if await asyncio.to_thread(_update, job_id, status="failed", error=str(e), finished_at=datetime.utcnow()):
+            # Failed jobs are never retried, so nothing will pick their files up again
+            await asyncio.to_thread(_discard_job_files, job_id)
+
+
+def _claim_next():
+    """
+    Claims the oldest queued job for this process and returns its id (or None). The claim is a
+    conditional UPDATE, so when several processes race for one job exactly one of them gets it.
+    """
+    db = SessionLocal()
+    try:
+        candidates = db.query(models.AuditJob.id).filter(
+            models.AuditJob.status == "queued"
+        ).order_by(models.AuditJob.created_at).limit(JOB_CONCURRENCY).all()
+        for (job_id,) in candidates:
+            claimed = db.query(models.AuditJob).filter(
+                models.AuditJob.id == job_id,
+                models.AuditJob.status == "queued"
+            ).update(
+                {"status": "running", "progress": 10, "worker_id": WORKER_ID, "heartbeat_at": datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.commit()
+            if claimed == 1:
+                return job_id
+        return None
+    finally:
+        db.close()
+
+
+def _heartbeat(job_ids):
+    db = SessionLocal()
+    try:
+        db.query(models.AuditJob).filter(
+            models.AuditJob.id.in_(job_ids),
+            models.AuditJob.worker_id == WORKER_ID,
+            models.AuditJob.status == "running"
+        ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def recover_interrupted():
+    """
+    Running jobs whose owner stopped heartbeating (its process died or was restarted) go back
+    to the queue. Jobs other live processes are running are left alone.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    db = SessionLocal()
+    try:
+        stale = db.query(models.AuditJob).filter(
+            models.AuditJob.status == "running",
+            (models.AuditJob.heartbeat_at < cutoff) | (models.AuditJob.heartbeat_at.is_(None))
+        )
+        # Died after saving its audit: running it again would duplicate that audit
+        stale.filter(models.AuditJob.audit_id.isnot(None)).update({
+            "status": "failed", "worker_id": None, "finished_at": datetime.utcnow(),
+            "error": "Interrupted while writing the result; the audit itself was saved"
+        }, synchronize_session=False)
+        stale.filter(models.AuditJob.audit_id.is_(None)).update(
+            {"status": "queued", "progress": 0, "worker_id": None}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def queued_count():
+    db = SessionLocal()
+    try:
+        return db.query(models.AuditJob).filter(models.AuditJob.status == "queued").count()
+    finally:
+        db.close()
+
+
+# Read at scrape time (status is indexed), so it can't drift from what's in SQL
+metrics.Gauge("adoptimizer_jobs_queued", "Audit jobs waiting for the job worker", callback=queued_count)
+
+
+# --- 3. THE WORKER LOOP (started from the app lifespan) ---
+async def run_worker():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    running = {}  # task -> job id
+
+    while True:
+        # Every pass: keep our claims fresh, and pick up jobs a dead process left behind
+        if running:
+            await asyncio.to_thread(_heartbeat, list(running.values()))
+        await asyncio.to_thread(recover_interrupted)
+
+        while len(running) < JOB_CONCURRENCY:
+            job_id = await asyncio.to_thread(_claim_next)
+            if job_id is None:
+                break
+            task = asyncio.create_task(_run_guarded(job_id))
+            running[task] = job_id
+            task.add_done_callback(lambda t: (running.pop(t, None), _wake()))
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -1,70 +1,424 @@
 import os
-import io
-import pandas as pd
+import json
+import time
+import base64
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Request, Response, Header, Query
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import case, or_, and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from . import models, security
-from .database import engine, get_db, Base
-from .model import run_clustering, calculate_savings
+from . import models, security, workers, jobs, audits, results_store, metrics
+from .database import get_db, get_async_db, run_in_session, dispose_engines, init_schema, DB_AUTO_MIGRATE
 
-Base.metadata.create_all(bind=engine)
+# 1 = pre-load the analysis workers (imports + a tiny fit) at startup; /ready answers 503 until done
+WARMUP_WORKERS = os.getenv("WARMUP_WORKERS", "0") == "1"
+_startup = {"ready": False, "warmed_workers": 0}
 
-app = FastAPI()
+
+async def _warm_up():
+    try:
+        _startup["warmed_workers"] = await workers.warm_up_pool()
+        # The API process itself reads Parquet pages and checks passwords
+        await asyncio.to_thread(results_store.warm_up)
+        await asyncio.to_thread(security.get_pwd_context)
+    finally:
+        # A failed warm-up only costs speed; the first upload does the same work lazily
+        _startup["ready"] = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema setup lives here (or in `python -m app.migrate`), not at import time
+    if DB_AUTO_MIGRATE:
+        await asyncio.to_thread(init_schema)
+    job_worker = asyncio.create_task(jobs.run_worker())
+    warm_up = asyncio.create_task(_warm_up()) if WARMUP_WORKERS else None
+    if warm_up is None:
+        _startup["ready"] = True
+    yield
+    for task in (job_worker, warm_up):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await task
+    # Don't leave orphaned analysis processes behind on shutdown/--reload
+    workers.shutdown_executor()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
+# Big upload payloads compress ~5-10x; tiny responses aren't worth it
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# --- REQUEST METRICS + OPT-IN PROFILING ---
+# With PROFILING_ENABLED=1 a request sent with "X-Profile: 1" (or a pstats sort key such as
+# "X-Profile: tottime") gets a cProfile summary back instead of its normal body.
+# It's off by default and then costs one boolean check per request.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP_FUNCTIONS", "40"))
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "ncalls")
+_profile_lock = asyncio.Lock()
+
+
+def _observe_request(request: Request, status_code: int, start: float):
+    # Route templates (/delete-audit/{audit_id}), not raw paths, so ids don't explode the label set
+    route = request.scope.get("route")
+    metrics.request_seconds.observe(
+        time.perf_counter() - start, request.method, route.path if route else "unmatched", str(status_code)
+    )
+
+
+async def _profiled(request: Request, call_next):
+    import io
+    import cProfile
+    import pstats
+
+    sort_key = request.headers["x-profile"] if request.headers["x-profile"] in PROFILE_SORT_KEYS else "cumulative"
+    # One profiler at a time; anything else the event loop runs meanwhile shows up in the profile too
+    async with _profile_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = await call_next(request)
+            async for _ in response.body_iterator:  # streamed bodies are part of the work
+                pass
+        finally:
+            profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats(sort_key).print_stats(PROFILE_TOP_FUNCTIONS)
+    return PlainTextResponse(out.getvalue(), headers={"X-Profiled-Status": str(response.status_code)})
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    if PROFILING_ENABLED and "x-profile" in request.headers:
+        return await _profiled(request, call_next)
+
+    start = time.perf_counter()
+    metrics.requests_in_flight.inc()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.requests_in_flight.dec()
+        _observe_request(request, 500, start)
+        raise
+
+    # Latency runs until the last body byte, so streamed NDJSON uploads are measured in full
+    body = response.body_iterator
+
+    async def body_then_observe():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            metrics.requests_in_flight.dec()
+            _observe_request(request, response.status_code, start)
+
+    response.body_iterator = body_then_observe()
+    return response
+
+# --- RESPONSE FORMATS ---
+# ?format= wins over the Accept header; plain JSON stays the default
+RESPONSE_FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/vnd.adoptimizer.columnar+json": "columnar",
+}
+
+
+def pick_response_format(requested: Optional[str], accept: Optional[str]):
+    if requested:
+        if requested not in ("json", "columnar", "ndjson"):
+            raise HTTPException(status_code=400, detail="format must be json, columnar or ndjson")
+        return requested
+    for media_type, fmt in RESPONSE_FORMATS.items():
+        if accept and media_type in accept:
+            return fmt
+    return "json"
 
 # --- ENDPOINT 1: UPLOAD & AUTO-SAVE ---
 @app.post("/upload-logistics")
 async def upload_data(
     file: UploadFile = File(...), 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
+    current_user: models.User = Depends(security.get_current_user),
+    mode: str = "sync",
+    auto_k: bool = False,
+    warm_start: bool = False,
+    response_format: Optional[str] = Query(None, alias="format"),
+    accept: Optional[str] = Header(None)
 ):
+    """
+    Analyze + save. Row data comes back as JSON records (default), as column arrays
+    (format=columnar) or streamed as NDJSON (format=ndjson: header line, then one line per row).
+    auto_k=true picks the number of ad groups from the data instead of the fixed 3.
+    warm_start=true starts from this user's previous centroids, so group ids stay put between audits.
+    """
+    fmt = pick_response_format(response_format, accept)
+    upload_path = None
     try:
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents))
-        
-        # 1. AI Analysis
-        result = run_clustering(df)
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
-
-        # 2. Calculate Values
-        savings_value = calculate_savings(df, result.get("group_insights", {}))
-        total_spend_value = float(df['Spend'].sum())
-
-        # 3. Create & Save Record (The "Save" logic is now here!)
-        new_audit = models.Audit(
-            filename=file.filename,
-            total_spend=total_spend_value,
-            potential_savings=float(savings_value),
-            user_id=current_user.id
+        # Spool to disk instead of holding the whole file in memory. Job uploads go straight to the
+        # job dir, so enqueue's move is a rename rather than a copy across filesystems
+        with metrics.timed("spool_upload"):
+            upload_path = await workers.spool_upload(file, jobs.JOB_STORAGE_DIR if mode == "job" else None)
+
+        # Job mode: hand back a ticket right away, poll /audit-jobs/{id} for the result
+        if mode == "job":
+            job = await run_in_session(jobs.enqueue, current_user.id, file.filename, upload_path, auto_k, warm_start)
+            return {"status": "queued", "job_id": job.id}
+
+        # 1 + 2. AI Analysis & Values (runs on the worker pool, not the event loop)
+        # Re-uploads of an identical file are answered from the result cache
+        init_centroids = await run_in_session(audits.load_centroids, current_user.id) if warm_start else None
+        # Queue wait + worker time (the worker's own stages are recorded separately)
+        with metrics.timed("analysis"):
+            outcome, cache_hit = await workers.run_analysis(upload_path, auto_k, init_centroids)
+        if "error" in outcome:
+            raise HTTPException(status_code=400, detail=outcome["error"])
+
+        # 3. Create & Save Record (The "Save" logic is now here!) - cache hits get their own Audit too
+        with metrics.timed("save_audit"):
+            new_audit = await run_in_session(audits.save_audit, current_user.id, file.filename, outcome)
+        if fmt == "ndjson":
+            header = audits.response_header(new_audit, outcome)
+            header["cached"] = cache_hit
+            return StreamingResponse(audits.iter_ndjson(header, outcome), media_type="application/x-ndjson")
+
+        # Reading every row back from Parquet and encoding it takes ~0.7 s per 300k rows: not on the event loop
+        with metrics.timed("serialize"):
+            body = await asyncio.to_thread(audits.encode_response, new_audit, outcome, fmt, cached=cache_hit)
+        return Response(body, media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Job mode already moved the file into the job dir
+        workers.discard_upload(upload_path)
+
+# --- ENDPOINT 1a: BULK UPLOAD (many CSVs and/or zip archives in one request) ---
+def _bulk_error(filename: str, detail: str):
+    return {"filename": filename, "status": "error", "detail": detail}
+
+
+@app.post("/upload-logistics/bulk")
+async def upload_bulk(
+    files: List[UploadFile] = File(...),
+    current_user: models.User = Depends(security.get_current_user),
+    auto_k: bool = False,
+    warm_start: bool = False
+):
+    """
+    Analyzes every file in parallel on the worker pool and saves all audits in one commit.
+    One bad file doesn't sink the rest: it gets status "error" in `files` and is skipped.
+    Row data isn't returned here, page it from /audit-results/{database_id}.
+    """
+    if len(files) > workers.BULK_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {workers.BULK_MAX_FILES} files per request")
+
+    spooled = []
+    entries = []  # (filename, spooled path or None, error or None), in upload order
+    unpacked_bytes = 0
+    try:
+        for index, file in enumerate(files):
+            path = await workers.spool_upload(file)
+            spooled.append(path)
+            if not (file.filename or "").lower().endswith(".zip"):
+                entries.append((file.filename, path, None))
+                continue
+            # The limits are per request: leave room for the files still to come and what earlier zips used
+            files_left = workers.BULK_MAX_FILES - len(entries) - (len(files) - index - 1)
+            try:
+                members = await asyncio.to_thread(
+                    workers.expand_zip, path, files_left, workers.BULK_MAX_UNPACKED_BYTES - unpacked_bytes
+                )
+            except ValueError as e:
+                entries.append((file.filename, None, str(e)))
+                continue
+            member_paths = [member_path for _, member_path, _ in members if member_path]
+            spooled.extend(member_paths)
+            unpacked_bytes += sum(os.path.getsize(member_path) for member_path in member_paths)
+            entries.extend(members)
+
+        init_centroids = await run_in_session(audits.load_centroids, current_user.id) if warm_start else None
+        runnable = [i for i, (_, path, _) in enumerate(entries) if path]
+        analyzed = await workers.run_analysis_batch([entries[i][1] for i in runnable], auto_k, init_centroids)
+
+        results = [_bulk_error(name, error) for name, _, error in entries]
+        to_save = []  # (entry index, outcome, cache_hit)
+        for i, result in zip(runnable, analyzed):
+            if isinstance(result, HTTPException):
+                results[i] = _bulk_error(entries[i][0], result.detail)
+            elif isinstance(result, Exception):
+                results[i] = _bulk_error(entries[i][0], str(result))
+            elif "error" in result[0]:
+                results[i] = _bulk_error(entries[i][0], result[0]["error"])
+            else:
+                to_save.append((i, *result))
+
+        # 3. One transaction for the whole batch instead of a commit per file
+        audit_ids = await run_in_session(
+            audits.save_audits, current_user.id, [(entries[i][0], outcome) for i, outcome, _ in to_save]
         )
-        db.add(new_audit)
-        db.commit()
-        db.refresh(new_audit)
+        for audit_id, (i, outcome, cache_hit) in zip(audit_ids, to_save):
+            results[i] = {
+                "filename": entries[i][0],
+                "status": "success",
+                "database_id": audit_id,
+                "row_count": outcome["analysis"].get("row_count"),
+                "summary": {"total_spend": outcome["total_spend"], "savings": outcome["savings"]},
+                "cached": cache_hit
+            }
 
-        return {
+        return Response(audits.dumps({
             "status": "success",
-            "database_id": new_audit.id,
-            "analysis": result,
-            "summary": {"total_spend": total_spend_value, "savings": savings_value}
-        }
+            "succeeded": len(to_save),
+            "failed": len(results) - len(to_save),
+            "files": results
+        }), media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        for path in spooled:
+            workers.discard_upload(path)
+
+# --- ENDPOINT 1b: QUEUED AUDIT JOBS ---
+def _get_own_job(job_id: str, db: Session, current_user: models.User):
+    job = db.query(models.AuditJob).filter(
+        models.AuditJob.id == job_id,
+        models.AuditJob.user_id == current_user.id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or unauthorized")
+    return job
+
+
+@app.get("/audit-jobs/{job_id}")
+def get_job_status(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    job = _get_own_job(job_id, db, current_user)
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "progress": job.progress,
+        "error": job.error,
+        "database_id": job.audit_id,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at
+    }
+
+
+@app.get("/audit-jobs/{job_id}/result")
+def get_job_result(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    job = _get_own_job(job_id, db, current_user)
+    if job.status == "failed":
+        raise HTTPException(status_code=400, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status} ({job.progress}%)")
+    if job.result_path is None:
+        raise HTTPException(status_code=404, detail="The audit for this job was deleted")
+    # Same payload as a sync upload, served straight from disk
+    return FileResponse(job.result_path, media_type="application/json")
 
 # --- ENDPOINT 2: SECURE HISTORY ---
+HISTORY_FIELDS = ("id", "filename", "total_spend", "potential_savings", "timestamp", "user_id")
+
+
+def _encode_cursor(timestamp: datetime, audit_id: int):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{audit_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        ts, audit_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(audit_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/history")
 async def get_history(
-    db: Session = Depends(get_db),
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    order: str = "desc",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    min_savings: Optional[float] = None,
+    max_savings: Optional[float] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
+    """
+    One page of the user's audits, newest first by default. Keyset paging on (timestamp, id):
+    pass the X-Next-Cursor response header back as `cursor` for the next page.
+    """
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(HISTORY_FIELDS)
+    unknown = [f for f in selected if f not in HISTORY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+    limit = min(max(limit, 1), 1000)
+
     # This filters the database so users only see their own folders
-    return db.query(models.Audit).filter(models.Audit.user_id == current_user.id).all()
+    # (id + timestamp always come along, the cursor is built from them)
+    columns = [getattr(models.Audit, f) for f in dict.fromkeys(selected + ["id", "timestamp"])]
+    query = select(*columns).filter(models.Audit.user_id == current_user.id)
+
+    if start_date is not None:
+        query = query.filter(models.Audit.timestamp >= start_date)
+    if end_date is not None:
+        query = query.filter(models.Audit.timestamp <= end_date)
+    if min_savings is not None:
+        query = query.filter(models.Audit.potential_savings >= min_savings)
+    if max_savings is not None:
+        query = query.filter(models.Audit.potential_savings <= max_savings)
+
+    if cursor:
+        ts, last_id = _decode_cursor(cursor)
+        if order == "desc":
+            query = query.filter(or_(
+                models.Audit.timestamp < ts,
+                and_(models.Audit.timestamp == ts, models.Audit.id < last_id)
+            ))
+        else:
+            query = query.filter(or_(
+                models.Audit.timestamp > ts,
+                and_(models.Audit.timestamp == ts, models.Audit.id > last_id)
+            ))
+
+    if order == "desc":
+        query = query.order_by(models.Audit.timestamp.desc(), models.Audit.id.desc())
+    else:
+        query = query.order_by(models.Audit.timestamp.asc(), models.Audit.id.asc())
+
+    # Fetch one extra row to know whether another page exists
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    return [{f: getattr(row, f) for f in selected} for row in rows]
 
 # --- ENDPOINT 3: DELETE AUDIT ---
 @app.delete("/delete-audit/{audit_id}")
-async def delete_audit(
+def delete_audit(
     audit_id: int, 
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user)
@@ -77,14 +431,92 @@ async def delete_audit(
     if not audit:
         raise HTTPException(status_code=404, detail="Audit not found or unauthorized")
     
-    db.delete(audit)
-    db.commit()
+    audits.delete_audit(db, audit)
     return {"message": "Deleted successfully"}
 
 
+# --- ENDPOINT 3b: STORED ROW-LEVEL RESULTS ---
+@app.get("/audit-results/{audit_id}")
+# Plain def: FastAPI runs it in its threadpool, so the Parquet read stays off the event loop
+def get_audit_results(
+    audit_id: int,
+    offset: int = 0,
+    limit: int = 1000,
+    columns: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    result_set = db.query(models.AuditResultSet).join(models.Audit).filter(
+        models.AuditResultSet.audit_id == audit_id,
+        models.Audit.user_id == current_user.id
+    ).first()
+
+    if not result_set:
+        raise HTTPException(status_code=404, detail="Stored results not found or unauthorized")
+
+    selected = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    # Echo the values actually used, clients page from them
+    offset, limit = max(offset, 0), min(max(limit, 1), 10000)
+    try:
+        total_rows, rows = results_store.read_page(result_set.results_path, offset, limit, selected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="Stored rows for this audit are no longer available")
+
+    return {
+        "audit_id": audit_id,
+        "total_rows": total_rows,
+        "offset": offset,
+        "limit": limit,
+        "rows": rows,
+        "analysis": json.loads(result_set.analysis_summary)
+    }
+
+
 #-------Audit Details -----------#
+@app.get("/filter-details")
+async def filter_all_audit_details(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_user),
+    min_savings_target: float = 100.0
+):
+    """Bulk version of /filter-details/{id}: every audit of the user, classified in one query."""
+    priority = case(
+        (models.Audit.potential_savings < min_savings_target, "low_priority"),
+        else_="high_priority"
+    ).label("status")
+
+    rows = (await db.execute(select(
+        models.Audit.id,
+        models.Audit.filename,
+        models.Audit.total_spend,
+        models.Audit.potential_savings,
+        models.Audit.timestamp,
+        priority
+    ).filter(
+        models.Audit.user_id == current_user.id
+    ).order_by(models.Audit.timestamp.desc(), models.Audit.id.desc()))).all()
+
+    return [
+        {
+            "id": row.id,
+            "filename": row.filename,
+            "total_spend": row.total_spend,
+            "potential_savings": row.potential_savings,
+            "timestamp": row.timestamp,
+            "status": row.status,
+            "message": (
+                "CRITICAL: Significant waste detected!" if row.status == "high_priority"
+                else f"Savings of ${row.potential_savings:.2f} are below target."
+            )
+        }
+        for row in rows
+    ]
+
+
 @app.get("/filter-details/{audit_id}")
-async def filter_audit_details(
+def filter_audit_details(
     audit_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user),
@@ -123,7 +555,7 @@ async def filter_audit_details(
 
 
 @app.patch("/rename-audit/{audit_id}")
-async def rename_audit(
+def rename_audit(
     audit_id: int,
     new_name: str,
     db: Session = Depends(get_db),
@@ -143,29 +575,40 @@ async def rename_audit(
 
 # --- AUTH ENDPOINTS (SIGNUP/LOGIN) ---
 @app.post("/signup")
-async def signup(data: dict, db: Session = Depends(get_db)):
+async def signup(data: dict):
     # Simple check to prevent crashes if keys are missing
     if "username" not in data or "password" not in data:
         raise HTTPException(status_code=400, detail="Username and password are required")
         
-    hashed_pwd = security.hash_password(data["password"])
-    new_user = models.User(username=data["username"], hashed_password=hashed_pwd)
-    db.add(new_user)
-    db.commit()
+    # Hash before touching the DB so no connection is held during the bcrypt wait
+    hashed_pwd = await security.hash_password_async(data["password"])
+    await run_in_session(_add_user, data["username"], hashed_pwd)
     return {"status": "success"}
 
+
+def _add_user(db: Session, username: str, hashed_password: str):
+    db.add(models.User(username=username, hashed_password=hashed_password))
+    db.commit()
+
+
+def _password_hash_of(db: Session, username: str):
+    user = db.query(models.User).filter(models.User.username == username).first()
+    return user.hashed_password if user else None
+
 from fastapi.security import OAuth2PasswordRequestForm
 
 @app.post("/login")
 async def login(
-    form_data: OAuth2PasswordRequestForm = Depends(), # Changed from data: dict
-    db: Session = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends() # Changed from data: dict
 ):
+    security.check_login_rate(form_data.username)
+
     # Use form_data.username instead of data["username"]
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
+    # The connection goes back to the pool before the bcrypt wait
+    hashed = await run_in_session(_password_hash_of, form_data.username)
     
-    if user and security.verify_password(form_data.password, user.hashed_password):
-        token = security.create_access_token(data={"sub": user.username})
+    if hashed and await security.verify_password_async(form_data.password, hashed):
+        token = security.create_access_token(data={"sub": form_data.username})
         return {"access_token": token, "token_type": "bearer"} # Removed "status" to follow OAuth2 standard
         
     raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -173,11 +616,107 @@ async def login(
 
 @app.get("/user/profile")
 async def get_profile(
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
+    # COUNT in SQL instead of loading every Audit through the relationship
+    audit_count = (await db.execute(select(func.count(models.Audit.id)).filter(
+        models.Audit.user_id == current_user.id
+    ))).scalar()
     return {
         "username": current_user.username, 
         "id": current_user.id, 
         "joined": current_user.created_at,
-        "audit_count": len(current_user.audits) # This now works because of your relationship
-    }
\ No newline at end of file
+        "audit_count": audit_count
+    }
+
+
+STATS_BUCKETS = ("day", "week", "month")
+
+
+def _stats_period(bucket: str, dialect: str):
+    """
+    The period label, identical on SQLite and Postgres: YYYY-MM-DD for days, the Monday a week
+    starts on (ISO weeks, also YYYY-MM-DD) for weeks, YYYY-MM for months.
+    """
+    timestamp = models.Audit.timestamp
+    if dialect != "sqlite":
+        # date_trunc('week') lands on the Monday too
+        return func.to_char(func.date_trunc(bucket, timestamp), "YYYY-MM" if bucket == "month" else "YYYY-MM-DD")
+    if bucket == "month":
+        return func.strftime("%Y-%m", timestamp)
+    if bucket == "week":
+        # 'weekday 0' moves forward to the Sunday (or stays on it), six days back is that week's Monday
+        return func.date(timestamp, "weekday 0", "-6 days")
+    return func.date(timestamp)
+
+
+@app.get("/user/stats")
+async def get_user_stats(
+    bucket: str = "month",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Totals plus spend/savings per day, week or month, all aggregated in SQL (see _stats_period for the labels)."""
+    if bucket not in STATS_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(STATS_BUCKETS)}")
+
+    period = _stats_period(bucket, db.bind.dialect.name).label("period")
+
+    filters = [models.Audit.user_id == current_user.id]
+    if start_date is not None:
+        filters.append(models.Audit.timestamp >= start_date)
+    if end_date is not None:
+        filters.append(models.Audit.timestamp <= end_date)
+
+    aggregates = (
+        func.count(models.Audit.id).label("audit_count"),
+        func.coalesce(func.sum(models.Audit.total_spend), 0.0).label("total_spend"),
+        func.coalesce(func.sum(models.Audit.potential_savings), 0.0).label("potential_savings"),
+    )
+    totals = (await db.execute(select(*aggregates).filter(*filters))).one()
+    series = (await db.execute(
+        select(period, *aggregates).filter(*filters).group_by(period).order_by(period)
+    )).all()
+
+    return {
+        "bucket": bucket,
+        "totals": {
+            "audit_count": totals.audit_count,
+            "total_spend": totals.total_spend,
+            "potential_savings": totals.potential_savings
+        },
+        "series": [
+            {
+                "period": row.period,
+                "audit_count": row.audit_count,
+                "total_spend": row.total_spend,
+                "potential_savings": row.potential_savings
+            }
+            for row in series
+        ]
+    }
+
+
+# --- OPERATIONS ---
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 while WARMUP_WORKERS is still pre-loading the analysis workers."""
+    if not _startup["ready"]:
+        return Response(audits.dumps({"status": "warming_up"}), status_code=503, media_type="application/json")
+    return {"status": "ready", "warmed_workers": _startup["warmed_workers"]}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text format: request latency, per-stage timings, queue gauges, cache hit rates."""
+    # Some gauges (queued jobs) query the DB at scrape time
+    body = await asyncio.to_thread(metrics.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
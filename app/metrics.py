@@ -0,0 +1,176 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# --- A TINY PROMETHEUS-STYLE REGISTRY ---
+# Kept dependency-free on purpose; /metrics renders everything registered here.
+_registry = []
+_lock = threading.Lock()
+
+# Seconds; tuned for "a few ms" (auth, history) up to "a minute" (big uploads)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_text(labelnames, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        _registry.append(self)
+
+    def inc(self, amount: float = 1):
+        with _lock:
+            self.value += amount
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Gauge:
+    """Goes up and down (inc/dec/set), or reads its value from `callback` at scrape time."""
+
+    def __init__(self, name: str, help_text: str, callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.value = 0
+        _registry.append(self)
+
+    def inc(self, amount: float = 1):
+        with _lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with _lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    @contextmanager
+    def track(self):
+        """+1 for the duration of the block (in-flight style gauges)."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def render(self):
+        value = self.value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []  # a failing probe shouldn't break the whole scrape
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {value}",
+        ]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per combination of label values."""
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum, count]
+        _registry.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 3)
+            series[index] += 1  # index == len(buckets) is the +Inf bucket
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labelvalues, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                labels = _label_text(self.labelnames, labelvalues, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- SHARED METRICS ---
+auth_cache_hits = Counter("adoptimizer_auth_cache_hits_total", "Requests authenticated from the token cache")
+auth_cache_misses = Counter("adoptimizer_auth_cache_misses_total", "Requests that needed a user lookup")
+result_cache_hits = Counter("adoptimizer_result_cache_hits_total", "Uploads answered from the result cache")
+result_cache_misses = Counter("adoptimizer_result_cache_misses_total", "Uploads that ran the full analysis")
+
+request_seconds = Histogram(
+    "adoptimizer_request_duration_seconds", "HTTP request latency, until the last body byte",
+    labelnames=("method", "route", "status")
+)
+stage_seconds = Histogram(
+    "adoptimizer_stage_duration_seconds", "Time spent in one stage of a request or analysis",
+    labelnames=("stage",)
+)
+requests_in_flight = Gauge("adoptimizer_requests_in_flight", "HTTP requests currently being served")
+analysis_queue_depth = Gauge("adoptimizer_analysis_queue_depth", "Analyses running or waiting for a pool worker")
+password_queue_depth = Gauge("adoptimizer_password_queue_depth", "bcrypt hashes running or waiting for a thread")
+
+
+# --- STAGE TIMING ---
+@contextmanager
+def timed(stage: str, into: dict = None):
+    """
+    Times a block as `stage`. With `into`, the seconds are added to that dict instead
+    (worker processes can't reach this registry; the API observes the dict, see observe_stages).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if into is None:
+            stage_seconds.observe(elapsed, stage)
+        else:
+            into[stage] = into.get(stage, 0.0) + elapsed
+
+
+def observe_stages(timings: dict):
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, stage)
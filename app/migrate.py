@@ -0,0 +1,11 @@
+"""
+Schema setup as a separate deploy step, so scaled-out API containers don't race on DDL at startup:
+
+    python -m app.migrate
+    DB_AUTO_MIGRATE=0 uvicorn app.main:app
+"""
+from .database import engine, init_schema
+
+if __name__ == "__main__":
+    init_schema()
+    print(f"Schema ready on {engine.url.render_as_string(hide_password=True)}")
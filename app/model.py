@@ -1,65 +1,343 @@
+import os
+import time
+import threading
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.metrics import silhouette_score
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from threadpoolctl import threadpool_limits
+from scipy.optimize import linear_sum_assignment
+from .metrics import timed
+from .model_config import (
+    SILHOUETTE_METHOD, SILHOUETTE_SAMPLE_SIZE, SILHOUETTE_SEED,
+    AUTO_K_MIN, AUTO_K_MAX, AUTO_K_N_INIT, AUTO_K_WORKERS, AUTO_K_TIME_BUDGET_SECONDS, DEFAULT_K,
+    AUTO_K_ITER_STEP, AUTO_K_MAX_ITER,
+    WARM_START_MAX_DRIFT, STREAM_CHUNK_ROWS, STREAM_PREVIEW_ROWS,
+)
 
-def run_clustering(df):
+def simplified_silhouette(X, labels, centers):
+    """Silhouette using distance to centroids instead of every other point."""
+    X = np.asarray(X, dtype=float)
+    dists = np.linalg.norm(X[:, None, :] - centers[None, :, :], axis=2)
+    idx = np.arange(len(X))
+    a = dists[idx, labels]
+    dists[idx, labels] = np.inf
+    b = dists.min(axis=1)
+    denom = np.maximum(a, b)
+    s = np.divide(b - a, denom, out=np.zeros_like(a), where=denom > 0)
+    return float(s.mean())
+
+def score_clusters(X, labels, centers, method=None, sample_size=None):
+    """Returns (score, method_used, rows_scored) so audits stay comparable."""
+    method = method or SILHOUETTE_METHOD
+    sample_size = sample_size or SILHOUETTE_SAMPLE_SIZE
+    n_rows = len(X)
+
+    if method == "auto":
+        method = "exact" if n_rows <= sample_size else "sampled"
+
+    if method == "simplified":
+        return simplified_silhouette(X, labels, centers), method, n_rows
+    if method == "sampled" and n_rows > sample_size:
+        score = silhouette_score(X, labels, sample_size=sample_size, random_state=SILHOUETTE_SEED)
+        return float(score), method, sample_size
+    return float(silhouette_score(X, labels)), "exact", n_rows
+
+def safe_ratio(numerator, denominator):
+    """numerator / denominator, 0 where the denominator is 0 or a value is missing (one pass, no temp Series)."""
+    numerator, denominator = np.asarray(numerator), np.asarray(denominator)
+    out = np.zeros(len(numerator), dtype=np.result_type(numerator, denominator, np.float32))
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    out[np.isnan(out)] = 0
+    return out
+
+def _fit_candidate(X, k, stop):
+    """
+    KMeans with AUTO_K_N_INIT inits, run AUTO_K_ITER_STEP Lloyd iterations at a time (at most
+    AUTO_K_MAX_ITER in all) so a search that ran out of time can really stop it: once
+    `stop` (a threading.Event) is set the fit returns None at the next step.
+    """
+    best = None
+    for init_seed in range(AUTO_K_N_INIT):
+        fitted, init = None, "k-means++"
+        for _ in range(0, AUTO_K_MAX_ITER, AUTO_K_ITER_STEP):
+            if stop.is_set():
+                return None
+            # Each step resumes from the last step's centers
+            fitted = KMeans(n_clusters=k, init=init, random_state=42 + init_seed, n_init=1, max_iter=AUTO_K_ITER_STEP).fit(X)
+            if fitted.n_iter_ < AUTO_K_ITER_STEP:
+                break  # converged inside this step
+            init = fitted.cluster_centers_
+        if best is None or fitted.inertia_ < best.inertia_:
+            best = fitted
+    if stop.is_set():
+        return None
+    score, _, _ = score_clusters(X, best.labels_, best.cluster_centers_, method="sampled")
+    return best, best.labels_, score
+
+def select_k(X, k_min=None, k_max=None, budget_seconds=None, workers=None):
+    """
+    Fits k_min..k_max in parallel threads (all sharing the same X, no copies) and keeps the
+    best sampled silhouette. Candidates still running when the time budget runs out are stopped
+    (within one AUTO_K_ITER_STEP) before this returns, so no fit outlives the search.
+    Returns (kmeans, labels, search_report) or (None, None, report) if nothing finished in time.
+    """
+    k_min, k_max = k_min or AUTO_K_MIN, k_max or AUTO_K_MAX
+    budget_seconds = budget_seconds or AUTO_K_TIME_BUDGET_SECONDS
+    workers = max(1, min(workers or AUTO_K_WORKERS, k_max - k_min + 1))
+    deadline = time.monotonic() + budget_seconds
+
+    pending_k = [k for k in range(k_min, k_max + 1) if k < len(X)]
+    running, scores, best = {}, {}, None
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="k-search")
+    # Split the cores between candidates instead of every fit grabbing all of them
+    with threadpool_limits(limits=max(1, (os.cpu_count() or 1) // workers)):
+        try:
+            while pending_k or running:
+                # Only start a candidate while there's budget left to finish it
+                while pending_k and len(running) < workers and time.monotonic() < deadline:
+                    k = pending_k.pop(0)
+                    running[executor.submit(_fit_candidate, X, k, stop)] = k
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not running:
+                    break
+                done, _ = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    k = running.pop(future)
+                    kmeans, labels, score = future.result()
+                    scores[k] = score
+                    if best is None or score > best[2]:
+                        best = (kmeans, labels, score)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    report = {
+        "mode": "auto",
+        "candidates": {int(k): float(v) for k, v in sorted(scores.items())},
+        "timed_out": bool(pending_k or running),
+        "time_budget_seconds": budget_seconds
+    }
+    if best is None:
+        return None, None, report
+    return best[0], best[1], report
+
+def centroid_drift(old_centers, new_centers):
+    """Largest move of any centroid, relative to that centroid's size (0 = identical model)."""
+    shift = np.linalg.norm(new_centers - old_centers, axis=1)
+    scale = np.maximum(np.linalg.norm(old_centers, axis=1), 1e-12)
+    return float((shift / scale).max())
+
+def match_to_previous(kmeans, labels, old_centers):
+    """
+    Renumbers a fresh fit so each cluster keeps the id of the nearest previous centroid.
+    Returns the relabeled labels (kmeans.cluster_centers_ is reordered in place).
+    """
+    cost = np.linalg.norm(old_centers[:, None, :] - kmeans.cluster_centers_[None, :, :], axis=2)
+    _, new_for_old = linear_sum_assignment(cost)
+    remap = np.empty_like(new_for_old)
+    remap[new_for_old] = np.arange(len(new_for_old))
+    kmeans.cluster_centers_ = kmeans.cluster_centers_[new_for_old]
+    return remap[labels]
+
+def warm_start_fit(X, init_centroids):
+    """
+    One KMeans run seeded with the previous centroids (n_init=1). Falls back to the full
+    n_init=10 fit when the centroids drift past WARM_START_MAX_DRIFT; either way cluster ids
+    line up with the previous audit. Returns (kmeans, labels, report).
+    """
+    old_centers = np.asarray(init_centroids, dtype=X.dtype)
+    k = len(old_centers)
+    kmeans = KMeans(n_clusters=k, init=old_centers, n_init=1, random_state=42)
+    labels = kmeans.fit_predict(X)
+    drift = centroid_drift(old_centers, kmeans.cluster_centers_)
+    report = {"used": True, "drift": drift, "max_drift": WARM_START_MAX_DRIFT, "fallback": False}
+    if drift > WARM_START_MAX_DRIFT:
+        kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+        labels = match_to_previous(kmeans, kmeans.fit_predict(X), old_centers)
+        report["fallback"] = True
+    return kmeans, labels, report
+
+def prepare_features(df):
+    """Column clean-up + derived metrics, shared by both engines."""
+    # 1. Clean Column Names
+    df.columns = [c.replace('Spent', 'Spend') for c in df.columns]
+
+    # 2. Metric Calculations (Ensuring Spend, CPC, and CTR exist)
+    if 'CPC' not in df.columns:
+        df['CPC'] = safe_ratio(df['Spend'], df['Clicks'])
+    if 'CTR' not in df.columns:
+        df['CTR'] = safe_ratio(df['Clicks'], df['Impressions'])
+    return df
+
+def group_sums(labels, k, cpc, ctr, spend):
+    """Per-cluster row count and CPC/CTR/Spend sums in one bincount each (float64 accumulators)."""
+    return (
+        np.bincount(labels, minlength=k),
+        np.bincount(labels, weights=np.asarray(cpc, dtype=np.float64), minlength=k),
+        np.bincount(labels, weights=np.asarray(ctr, dtype=np.float64), minlength=k),
+        np.bincount(labels, weights=np.asarray(spend, dtype=np.float64), minlength=k),
+    )
+
+def classify_group(avg_cpc, avg_ctr, overall_avg_cpc, overall_avg_ctr):
+    """Logic for identifying 'Risky' vs 'Scalable'. Returns (label, status, recommendation)."""
+    if avg_cpc > overall_avg_cpc:
+        return "Money Pit", "Risky", "High cost detected. Consider pausing."
+    elif avg_ctr > overall_avg_ctr:
+        return "Top Performer", "Scalable", "Efficient results. Safe to increase budget."
+    return "Stable", "Neutral", "Average performance. No changes needed."
+
+def build_group_insights(counts, cpc_sums, ctr_sums, spend_sums):
+    """Group Insights (labels, averages, spend) from the per-cluster sums of group_sums."""
+    n_rows = counts.sum()
+    overall_avg_cpc = cpc_sums.sum() / n_rows
+    overall_avg_ctr = ctr_sums.sum() / n_rows
+    group_insights = {}
+    for cluster_id in np.flatnonzero(counts):
+        avg_cpc = cpc_sums[cluster_id] / counts[cluster_id]
+        avg_ctr = ctr_sums[cluster_id] / counts[cluster_id]
+        label, status, rec = classify_group(avg_cpc, avg_ctr, overall_avg_cpc, overall_avg_ctr)
+        group_insights[int(cluster_id)] = {
+            "label": label, "status": status,
+            "CPC": float(avg_cpc), "CTR": float(avg_ctr), "recommendation": rec,
+            "ad_count": int(counts[cluster_id]),
+            "total_spend": float(spend_sums[cluster_id])
+        }
+    return group_insights
+
+def run_clustering(df, include_rows=True, auto_k=False, init_centroids=None, timings=None):
+    """
+    KMeans + group insights on a full DataFrame (labels land in df['ad_group']).
+    include_rows=False leaves detailed_results out, for callers that persist the frame themselves.
+    auto_k=True searches the cluster count (see select_k) instead of the fixed 3.
+    init_centroids (the user's previous model) warm-starts the fit, see warm_start_fit. It's
+    skipped (and listed in "ignored_options") when auto_k is on or the model has >= as many
+    clusters as the file has rows.
+    Stage timings go to `timings` (a dict) when given, straight to the metrics registry otherwise.
+    """
     try:
-        # 1. Clean Column Names
-        df.columns = [c.replace('Spent', 'Spend') for c in df.columns]
-
-        # 2. Metric Calculations (Ensuring Spend, CPC, and CTR exist)
-        if 'CPC' not in df.columns:
-            df['CPC'] = df['Spend'] / df['Clicks'].replace(0, np.nan)
-            df['CPC'] = df['CPC'].fillna(0)
-        if 'CTR' not in df.columns:
-            df['CTR'] = df['Clicks'] / df['Impressions'].replace(0, np.nan)
-            df['CTR'] = df['CTR'].fillna(0)
-
-        # 3. Select features (No Scaling to keep that 73.8% confidence)
-        features = ['Spend', 'CPC', 'CTR']
-        X = df[features].copy()
+        with timed("prepare_features", timings):
+            prepare_features(df)
 
-        # 4. Run AI with 3 Clusters (The original setup)
-        kmeans = KMeans(n_clusters=3, random_state=42, n_init=10)
-        df['ad_group'] = kmeans.fit_predict(X)
-        
-        # Calculate accuracy based on raw values
-        accuracy = silhouette_score(X, df['ad_group'])
+            # 3. Select features (No Scaling to keep that 73.8% confidence)
+            features = ['Spend', 'CPC', 'CTR']
+            X = df[features].to_numpy()
+
+        # 4. Run AI with 3 Clusters (The original setup), or the best k when asked to search
+        kmeans, labels, k_search, warm_start = (None, None, None, None)
+        if auto_k:
+            with timed("k_search", timings):
+                kmeans, labels, k_search = select_k(X)
+        elif init_centroids is not None and len(init_centroids) < len(X):
+            with timed("warm_start_fit", timings):
+                kmeans, labels, warm_start = warm_start_fit(X, init_centroids)
+        if kmeans is None:
+            with timed("kmeans_fit", timings):
+                kmeans = KMeans(n_clusters=DEFAULT_K, random_state=42, n_init=10)
+                labels = kmeans.fit_predict(X)
+        df['ad_group'] = labels
+        # Asked for, but neither the k search nor a too-small file can start from the old model
+        ignored = ["warm_start"] if init_centroids is not None and warm_start is None else []
         
-        # 5. Build Group Insights
-        group_insights = {}
-        overall_avg_cpc = df['CPC'].mean()
+        # Calculate accuracy based on raw values (sampled for big files, see score_clusters)
+        with timed("silhouette", timings):
+            accuracy, accuracy_method, accuracy_rows = score_clusters(X, labels, kmeans.cluster_centers_)
         
-        for cluster_id in sorted(df['ad_group'].unique()):
-            cluster_data = df[df['ad_group'] == cluster_id]
-            avg_cpc = cluster_data['CPC'].mean()
-            avg_ctr = cluster_data['CTR'].mean()
-            
-            # Logic for identifying 'Risky' vs 'Scalable'
-            if avg_cpc > overall_avg_cpc:
-                label, status = "Money Pit", "Risky"
-                rec = "High cost detected. Consider pausing."
-            elif avg_ctr > df['CTR'].mean():
-                label, status = "Top Performer", "Scalable"
-                rec = "Efficient results. Safe to increase budget."
-            else:
-                label, status = "Stable", "Neutral"
-                rec = "Average performance. No changes needed."
-            group_insights[int(cluster_id)] = {
-                "label": label, "status": status,
-                "CPC": avg_cpc, "CTR": avg_ctr, "recommendation": rec
-            }
-            
+        # 5. Build Group Insights (one bincount pass; per-group spend doubles as the savings input)
+        with timed("insights", timings):
+            group_insights = build_group_insights(
+                *group_sums(labels, kmeans.n_clusters, df['CPC'].to_numpy(), df['CTR'].to_numpy(), df['Spend'].to_numpy())
+            )
+
+        rows = {}
+        if include_rows:
+            with timed("to_dict", timings):
+                rows = {"detailed_results": df.to_dict('records')}
+
         return {
+            "engine": "standard",
+            "row_count": int(len(df)),
+            "n_clusters": int(kmeans.n_clusters),
+            **({"k_search": k_search} if k_search is not None else {}),
+            **({"warm_start": warm_start} if warm_start is not None else {}),
+            **({"ignored_options": ignored} if ignored else {}),
             "model_accuracy_score": accuracy,
+            "model_accuracy_method": accuracy_method,
+            "model_accuracy_sample_size": accuracy_rows,
+            "group_insights": group_insights,
+            "centroids": kmeans.cluster_centers_.tolist(),
+            **rows
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+def run_clustering_streaming(source, chunksize=None, sink=None, read_options=None, timings=None):
+    """
+    Same output as run_clustering, but for exports too big for one DataFrame.
+    Pass 1 fits MiniBatchKMeans chunk by chunk, pass 2 labels the rows and keeps
+    only running per-cluster sums, so memory is bounded by the chunk size.
+    `sink(chunk)` (optional) receives every labeled chunk, e.g. to persist it.
+    `read_options` are extra pd.read_csv arguments (usecols, dtype).
+    `timings` works as in run_clustering (stream_fit / stream_label).
+    """
+    try:
+        chunksize = chunksize or STREAM_CHUNK_ROWS
+        read_options = read_options or {}
+        features = ['Spend', 'CPC', 'CTR']
+        k = DEFAULT_K
+
+        # Pass 1: incremental fit
+        kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3)
+        n_rows = 0
+        with timed("stream_fit", timings):
+            for chunk in pd.read_csv(source, chunksize=chunksize, **read_options):
+                prepare_features(chunk)
+                kmeans.partial_fit(chunk[features].to_numpy(dtype=float))
+                n_rows += len(chunk)
+        if hasattr(source, "seek"):
+            source.seek(0)
+
+        # Pass 2: label + aggregate
+        totals = [np.zeros(k) for _ in range(4)]  # counts, CPC, CTR, Spend sums
+        silhouette_sum = 0.0
+        preview_frac = min(1.0, STREAM_PREVIEW_ROWS / max(n_rows, 1))
+        preview = []
+        with timed("stream_label", timings):
+            for chunk in pd.read_csv(source, chunksize=chunksize, **read_options):
+                prepare_features(chunk)
+                X = chunk[features].to_numpy(dtype=float)
+                labels = kmeans.predict(X)
+                chunk['ad_group'] = labels
+                if sink is not None:
+                    sink(chunk)
+
+                sums = group_sums(labels, k, chunk['CPC'].to_numpy(), chunk['CTR'].to_numpy(), chunk['Spend'].to_numpy())
+                for total, part in zip(totals, sums):
+                    total += part
+                silhouette_sum += simplified_silhouette(X, labels, kmeans.cluster_centers_) * len(chunk)
+                preview.append(chunk.sample(frac=preview_frac, random_state=42) if preview_frac < 1 else chunk)
+
+        # Build Group Insights from the running sums
+        group_insights = build_group_insights(*totals)
+
+        preview_df = pd.concat(preview, ignore_index=True)
+        return {
+            "engine": "streaming",
+            "row_count": n_rows,
+            "n_clusters": k,
+            "model_accuracy_score": silhouette_sum / n_rows,
+            "model_accuracy_method": "simplified",
+            "model_accuracy_sample_size": n_rows,
             "group_insights": group_insights,
-            "detailed_results": df.to_dict('records')
+            "centroids": kmeans.cluster_centers_.tolist(),
+            "detailed_results": preview_df.to_dict('records'),
+            "detailed_results_truncated": len(preview_df) < n_rows
         }
     except Exception as e:
         return {"error": str(e)}
 
-def calculate_savings(results_df, group_insights):
-    risky_ids = [int(gid) for gid, info in group_insights.items() if info["status"] == "Risky"]
-    total_waste = results_df[results_df['ad_group'].isin(risky_ids)]['Spend'].sum()
-    return total_waste
\ No newline at end of file
+def savings_from_insights(group_insights):
+    """Waste straight from the per-group totals (no row-level frame needed)."""
+    return sum(info["total_spend"] for info in group_insights.values() if info["status"] == "Risky")
@@ -0,0 +1,31 @@
+import os
+
+# Analysis tunables, kept apart from model.py so the API process can build result-cache keys
+# (workers.model_params) without importing pandas / scikit-learn.
+
+# --- CONFIDENCE SCORE SETTINGS ---
+# auto = exact silhouette up to the sample size, seeded sample above it
+# exact / sampled / simplified (centroid-based, O(n*k)) force one method
+SILHOUETTE_METHOD = os.getenv("SILHOUETTE_METHOD", "auto")
+SILHOUETTE_SAMPLE_SIZE = int(os.getenv("SILHOUETTE_SAMPLE_SIZE", "10000"))
+SILHOUETTE_SEED = 42
+
+# --- AUTOMATIC CLUSTER COUNT (opt-in per upload) ---
+AUTO_K_MIN = int(os.getenv("AUTO_K_MIN", "2"))
+AUTO_K_MAX = int(os.getenv("AUTO_K_MAX", "8"))
+AUTO_K_N_INIT = int(os.getenv("AUTO_K_N_INIT", "3"))
+AUTO_K_WORKERS = int(os.getenv("AUTO_K_WORKERS", str(os.cpu_count() or 1)))
+AUTO_K_TIME_BUDGET_SECONDS = float(os.getenv("AUTO_K_TIME_BUDGET_SECONDS", "20"))
+# Candidate fits run this many Lloyd iterations at a time and stop between steps once the budget is gone
+AUTO_K_ITER_STEP = int(os.getenv("AUTO_K_ITER_STEP", "20"))
+AUTO_K_MAX_ITER = 300  # KMeans' own default
+DEFAULT_K = 3
+
+# --- WARM START (opt-in per upload, seeds KMeans with the user's last centroids) ---
+# Largest relative centroid shift still accepted; above it the data moved too much and we refit from scratch
+WARM_START_MAX_DRIFT = float(os.getenv("WARM_START_MAX_DRIFT", "0.25"))
+
+# --- STREAMING ENGINE SETTINGS ---
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "100000"))
+# Rows of detailed_results the streaming engine sends back (evenly sampled)
+STREAM_PREVIEW_ROWS = int(os.getenv("STREAM_PREVIEW_ROWS", "50000"))
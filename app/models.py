@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, func
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Text, Index, func
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime
@@ -21,4 +21,47 @@ class Audit(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     user_id = Column(Integer, ForeignKey("users.id"))
-    owner = relationship("User", back_populates="audits")
\ No newline at end of file
+    owner = relationship("User", back_populates="audits")
+
+    # Backs /history paging + ordering: every per-user query walks this index
+    __table_args__ = (Index("ix_audits_user_timestamp", "user_id", "timestamp"),)
+
+class AuditJob(Base):
+    """A queued /upload-logistics run. Lives in SQL so pending work survives a restart."""
+    __tablename__ = "audit_jobs"
+    id = Column(String, primary_key=True, index=True)
+    filename = Column(String)
+    status = Column(String, default="queued", index=True)  # queued -> running -> done / failed
+    progress = Column(Integer, default=0)
+    auto_k = Column(Boolean, default=False)
+    warm_start = Column(Boolean, default=False)
+    upload_path = Column(String)
+    result_path = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    audit_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    # Which process is running it and when it last said so; stale heartbeats get re-queued
+    worker_id = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    user_id = Column(Integer, ForeignKey("users.id"))
+
+
+class AuditResultSet(Base):
+    """Where an audit's row-level results live (Parquet) plus its insights, so it can be reopened."""
+    __tablename__ = "audit_results"
+    audit_id = Column(Integer, ForeignKey("audits.id"), primary_key=True)
+    results_path = Column(String, index=True)
+    row_count = Column(Integer)
+    analysis_summary = Column(Text)  # JSON: group_insights + accuracy fields, no row data
+
+
+class UserModel(Base):
+    """The centroids of a user's latest audit, used to warm-start their next upload."""
+    __tablename__ = "user_models"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    audit_id = Column(Integer, ForeignKey("audits.id"), nullable=True)
+    n_clusters = Column(Integer)
+    centroids = Column(Text)  # JSON: n_clusters x [Spend, CPC, CTR]
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
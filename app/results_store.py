@@ -0,0 +1,157 @@
+import os
+import time
+import uuid
+
+# pyarrow is imported inside the functions: only uploads and result reads need it,
+# so auth/history-only processes (and every cold start) skip its ~100 ms import
+
+# --- CONFIGURATION ---
+# One Parquet file per distinct upload (named by the cache fingerprint), shared by its audits
+RESULTS_DIR = os.getenv("RESULTS_DIR", "./audit_results")
+RESULTS_ROW_GROUP_ROWS = int(os.getenv("RESULTS_ROW_GROUP_ROWS", "65536"))
+# A file written or reused this recently may belong to an upload that hasn't saved its audit yet
+RESULTS_DELETE_GRACE_SECONDS = float(os.getenv("RESULTS_DELETE_GRACE_SECONDS", "60"))
+
+
+def warm_up():
+    """Pre-imports what the first result read needs: pyarrow, plus pandas (pyarrow loads it for our files' pandas metadata)."""
+    import pandas  # noqa: F401
+    import pyarrow.parquet  # noqa: F401
+
+
+def path_for(key: str):
+    return os.path.join(RESULTS_DIR, f"{key}.parquet")
+
+
+def private_path(path: str):
+    """A one-off sibling of `path`, for results that must not be shared under the fingerprint."""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{uuid.uuid4().hex[:12]}{ext}"
+
+
+def touch(path: str):
+    """Marks a shared file as in use by an upload (see remove_if_unused). False if it's gone."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def remove_if_unused(path: str, still_used):
+    """
+    Deletes a shared result file unless still_used() finds an audit on it or it was written or
+    touched within the grace period. It's renamed aside before the checks, so an upload that
+    touches it meanwhile fails the touch (and recomputes) instead of saving an audit on a dead file.
+    """
+    doomed = f"{path}.{uuid.uuid4().hex}.deleting"
+    try:
+        os.rename(path, doomed)
+    except FileNotFoundError:
+        return
+    if still_used() or time.time() - os.path.getmtime(doomed) < RESULTS_DELETE_GRACE_SECONDS:
+        os.replace(doomed, path)
+    else:
+        os.remove(doomed)
+
+
+def _widen(schema):
+    """
+    One schema every CSV chunk fits: ints (ad_group) as int64, all-empty columns as strings.
+    Metrics are already float32 and ids strings from the read options (workers.csv_read_options).
+    """
+    import pyarrow as pa
+
+    fields = []
+    for field in schema:
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.int64())
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+class ResultWriter:
+    """Appends labeled DataFrame chunks to one Parquet file. Written to a temp name, renamed on close."""
+
+    def __init__(self, path: str, widen: bool = True):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.widen = widen
+        self._tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self._writer = None
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            schema = _widen(table.schema) if self.widen else table.schema
+            self._writer = pq.ParquetWriter(self._tmp_path, schema)
+        table = table.select(self._writer.schema.names).cast(self._writer.schema)
+        self._writer.write_table(table, row_group_size=RESULTS_ROW_GROUP_ROWS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._writer is not None:
+            self._writer.close()
+            if exc_type is None:
+                os.replace(self._tmp_path, self.path)
+            else:
+                os.remove(self._tmp_path)
+        return False
+
+
+def write_frame(df, path: str):
+    # A single frame has one consistent schema, no widening needed
+    with ResultWriter(path, widen=False) as writer:
+        writer.write(df)
+
+
+def read_page(path: str, offset: int = 0, limit: int = 1000, columns=None):
+    """
+    Returns (total_rows, rows) for one page, only touching the row groups (and columns)
+    that overlap the requested window.
+    """
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    total_rows = pf.metadata.num_rows
+    if columns:
+        unknown = [c for c in columns if c not in pf.schema_arrow.names]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+    groups, skip, start = [], 0, 0
+    for i in range(pf.num_row_groups):
+        n = pf.metadata.row_group(i).num_rows
+        if start + n > offset and start < offset + limit:
+            if not groups:
+                skip = offset - start
+            groups.append(i)
+        start += n
+
+    if not groups:
+        return total_rows, []
+    table = pf.read_row_groups(groups, columns=columns or None).slice(skip, limit)
+    return total_rows, table.to_pylist()
+
+
+def read_records(path: str):
+    import pyarrow.parquet as pq
+    return pq.read_table(path).to_pylist()
+
+
+def read_columns(path: str):
+    import pyarrow.parquet as pq
+    return pq.read_table(path).to_pydict()
+
+
+def iter_record_batches(path: str, batch_rows: int):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        yield batch.to_pylist()
@@ -1,27 +1,106 @@
+import os
+import time
+import asyncio
+import threading
 import jwt
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from . import models, database
+from . import models, database, metrics
 
 # --- CONFIGURATION ---
 # In a real app, move these to environment variables
 SECRET_KEY = "super-secret-marketing-key-123" 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Verified tokens are remembered this long so protected endpoints skip the user lookup (0 = off)
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "1024"))
+# bcrypt runs on its own small pool (it releases the GIL, threads are enough)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "32"))
+# Login attempts allowed per username inside the sliding window
+LOGIN_MAX_ATTEMPTS = int(os.getenv("LOGIN_MAX_ATTEMPTS", "10"))
+LOGIN_WINDOW_SECONDS = float(os.getenv("LOGIN_WINDOW_SECONDS", "60"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 # --- 1. PASSWORD HASHING ---
+# passlib (+ its bcrypt backend) loads on first use; token-authenticated requests never need it
+_pwd_context = None
+_pwd_context_lock = threading.Lock()
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        with _pwd_context_lock:
+            if _pwd_context is None:
+                from passlib.context import CryptContext
+                context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+                context.handler("bcrypt").get_backend()  # load the backend now, not inside a login
+                _pwd_context = context
+    return _pwd_context
+
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_pwd: str, hashed: str):
-    return pwd_context.verify(plain_pwd, hashed)
+    return get_pwd_context().verify(plain_pwd, hashed)
+
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_password_slots = None
+
+async def _run_password_work(fn, *args):
+    """Keeps bcrypt off the event loop; past the pending limit callers get a 503 instead of a pile-up."""
+    global _password_slots
+    if _password_slots is None:
+        _password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS + PASSWORD_MAX_PENDING)
+    if _password_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service busy, please retry shortly.",
+            headers={"Retry-After": "2"},
+        )
+    with metrics.password_queue_depth.track(), metrics.timed("bcrypt"):
+        async with _password_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_password_executor, fn, *args)
+
+async def hash_password_async(password: str):
+    return await _run_password_work(hash_password, password)
+
+async def verify_password_async(plain_pwd: str, hashed: str):
+    return await _run_password_work(verify_password, plain_pwd, hashed)
+
+# --- 1b. LOGIN RATE LIMIT ---
+_login_attempts = {}  # username -> deque of attempt times
+_login_attempts_lock = threading.Lock()
+
+def check_login_rate(username: str):
+    """Sliding-window limit per username, so one account can't monopolize the bcrypt pool."""
+    now = time.monotonic()
+    with _login_attempts_lock:
+        if len(_login_attempts) > 10000:
+            # Forget usernames with no recent attempts
+            for name in [n for n, a in _login_attempts.items() if not a or now - a[-1] > LOGIN_WINDOW_SECONDS]:
+                del _login_attempts[name]
+
+        attempts = _login_attempts.setdefault(username, deque())
+        while attempts and now - attempts[0] > LOGIN_WINDOW_SECONDS:
+            attempts.popleft()
+        if len(attempts) >= LOGIN_MAX_ATTEMPTS:
+            retry_after = int(LOGIN_WINDOW_SECONDS - (now - attempts[0])) + 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts, please try again later.",
+                headers={"Retry-After": str(retry_after)},
+            )
+        attempts.append(now)
 
 # --- 2. TOKEN GENERATION ---
 def create_access_token(data: dict):
@@ -31,12 +110,61 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-# --- 3. THE CRITICAL MISSING METHOD ---
+# --- 3. VERIFIED TOKEN CACHE ---
+_token_cache = OrderedDict()  # token -> (expires_at, user_id, username, created_at)
+_token_cache_lock = threading.Lock()
+
+def _cached_user(token: str):
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None:
+            return None
+        if time.time() > entry[0]:
+            del _token_cache[token]
+            return None
+        _token_cache.move_to_end(token)
+    # A fresh, session-less User each time so callers can't mutate the cached identity
+    return models.User(id=entry[1], username=entry[2], created_at=entry[3])
+
+def _remember_user(token: str, payload: dict, user: models.User):
+    if AUTH_CACHE_TTL_SECONDS <= 0:
+        return
+    # Never outlive the token itself
+    expires_at = min(time.time() + AUTH_CACHE_TTL_SECONDS, payload.get("exp", float("inf")))
+    with _token_cache_lock:
+        _token_cache[token] = (expires_at, user.id, user.username, user.created_at)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > AUTH_CACHE_MAX_ENTRIES:
+            _token_cache.popitem(last=False)
+
+def invalidate_user(user_id: int):
+    """Drops every cached token of this user (called when the user row changes or goes away)."""
+    with _token_cache_lock:
+        for token in [t for t, entry in _token_cache.items() if entry[1] == user_id]:
+            del _token_cache[token]
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _on_user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+
+# --- 4. THE CRITICAL MISSING METHOD ---
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     """
     This is what 'main.py' was looking for.
     It takes the token from the Header, decodes it, and finds the user in SQL.
+    Recently verified tokens are answered from the cache without touching the DB.
     """
+    with metrics.timed("get_current_user"):
+        return _authenticate(token, db)
+
+def _authenticate(token: str, db: Session):
+    cached = _cached_user(token)
+    if cached is not None:
+        metrics.auth_cache_hits.inc()
+        return cached
+    metrics.auth_cache_misses.inc()
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -55,4 +183,5 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     user = db.query(models.User).filter(models.User.username == username).first()
     if user is None:
         raise credentials_exception
+    _remember_user(token, payload, user)
     return user
\ No newline at end of file
@@ -0,0 +1,334 @@
+import os
+import csv
+import shutil
+import asyncio
+import zipfile
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException
+from . import cache, results_store, metrics
+
+# --- CONFIGURATION ---
+# "process" keeps KMeans completely off the API's GIL, "thread" is lighter for small files
+ANALYSIS_EXECUTOR = os.getenv("ANALYSIS_EXECUTOR", "process")
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+# Uploads allowed to wait for a free worker before we start answering 503
+ANALYSIS_MAX_PENDING = int(os.getenv("ANALYSIS_MAX_PENDING", "8"))
+# auto = MiniBatchKMeans streaming above the row threshold, standard KMeans below it
+CLUSTER_ENGINE = os.getenv("CLUSTER_ENGINE", "auto")
+STREAMING_ROW_THRESHOLD = int(os.getenv("STREAMING_ROW_THRESHOLD", "500000"))
+# Where uploads are spooled before parsing (default: the system temp dir)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+# Bulk uploads, per request: files (zip members included) and total unpacked size of all zips
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "100"))
+BULK_MAX_UNPACKED_BYTES = int(os.getenv("BULK_MAX_UNPACKED_BYTES", str(4 << 30)))
+# How long one bulk file may wait for a pool slot before it's reported as failed
+BULK_QUEUE_WAIT_SECONDS = float(os.getenv("BULK_QUEUE_WAIT_SECONDS", "120"))
+
+# Only these columns are parsed (as float32); everything else in the export is skipped,
+# except identifier columns (ad_id, *_id) so rows stay traceable in the Detailed Audit tab
+METRIC_COLUMNS = ("Spend", "Spent", "Clicks", "Impressions", "CPC", "CTR")
+# "c" has the lowest peak memory; "pyarrow" parses ~2x faster but peaks ~3x higher
+CSV_PARSER = os.getenv("CSV_PARSER", "c")
+
+_executor = None
+_slots = None
+
+
+def get_executor():
+    """Creates the worker pool on first use so importing the app stays cheap."""
+    global _executor
+    if _executor is None:
+        if ANALYSIS_EXECUTOR == "thread":
+            _executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+        else:
+            _executor = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS)
+    return _executor
+
+
+def _preload_analytics():
+    """
+    Forked pool workers inherit the parent's modules, so importing the analytics stack here once
+    (before the first fork) saves every worker its own pandas/sklearn import. Import only: running a
+    fit here would start OpenMP threads in the parent, which forked children can't safely reuse.
+    """
+    if ANALYSIS_EXECUTOR != "thread" and multiprocessing.get_start_method() == "fork":
+        from . import model  # noqa: F401
+
+
+async def ensure_executor():
+    """get_executor for async callers: the preload runs in a thread, off the event loop."""
+    if _executor is None:
+        await asyncio.to_thread(_preload_analytics)
+    return get_executor()
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def submit(fn, *args):
+    """
+    Runs fn(*args) on the analysis pool without blocking the event loop.
+    Running + waiting jobs are capped, extra callers get a 503 right away (backpressure).
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(ANALYSIS_WORKERS + ANALYSIS_MAX_PENDING)
+    if _slots.locked():
+        raise HTTPException(
+            status_code=503,
+            detail="Analysis queue is full, please retry shortly.",
+            headers={"Retry-After": "5"},
+        )
+    with metrics.analysis_queue_depth.track():
+        async with _slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(await ensure_executor(), fn, *args)
+
+
+def model_params(auto_k=False, init_centroids=None):
+    """Every setting that changes the analysis output; part of the result cache key."""
+    from . import model_config as model
+    params = (
+        CLUSTER_ENGINE, STREAMING_ROW_THRESHOLD,
+        model.SILHOUETTE_METHOD, model.SILHOUETTE_SAMPLE_SIZE,
+        model.STREAM_CHUNK_ROWS, model.STREAM_PREVIEW_ROWS,
+    )
+    if auto_k:
+        params += ("auto_k", model.AUTO_K_MIN, model.AUTO_K_MAX, model.AUTO_K_N_INIT)
+    elif init_centroids is not None:
+        # A warm-started fit depends on where it started from
+        params += ("warm_start", model.WARM_START_MAX_DRIFT, init_centroids)
+    return params
+
+
+async def run_analysis(source, auto_k=False, init_centroids=None):
+    """
+    analyze_csv through the result cache: a re-uploaded file skips parsing and KMeans.
+    Returns (outcome, cache_hit).
+    """
+    with metrics.timed("fingerprint"):
+        key = await asyncio.to_thread(cache.fingerprint, source, model_params(auto_k, init_centroids))
+    outcome = cache.results.get(key)
+    # The row-level file may be gone if every audit that used it was deleted. Touching it also
+    # keeps a concurrent delete from removing it before this upload saves its audit
+    if outcome is not None and results_store.touch(outcome["results_path"]):
+        return outcome, True
+
+    outcome = await submit(analyze_csv, source, results_store.path_for(key), auto_k, init_centroids)
+    # Stage timings were taken in the worker, record them here where /metrics can see them
+    metrics.observe_stages(outcome.get("timings", {}))
+    if "error" not in outcome and not _timed_out(outcome["analysis"]):
+        cache.results.put(key, outcome)
+    return outcome, False
+
+
+def _timed_out(analysis):
+    """A k search cut short by its time budget: the result depends on timing, not just the file."""
+    return bool(analysis.get("k_search", {}).get("timed_out"))
+
+
+async def run_analysis_batch(sources, auto_k=False, init_centroids=None):
+    """
+    run_analysis for many files at once. At most ANALYSIS_WORKERS of them hold a pool slot at a
+    time, and a full queue means wait and retry rather than 503, so one bulk request can't starve
+    single uploads or fail half-way. Returns one (outcome, cache_hit) or exception per source.
+    """
+    batch_slots = asyncio.Semaphore(ANALYSIS_WORKERS)
+
+    async def one(source):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + BULK_QUEUE_WAIT_SECONDS
+        async with batch_slots:
+            while True:
+                try:
+                    return await run_analysis(source, auto_k, init_centroids)
+                except HTTPException as e:
+                    if e.status_code != 503 or loop.time() >= deadline:
+                        raise
+                    await asyncio.sleep(1)
+
+    return await asyncio.gather(*(one(source) for source in sources), return_exceptions=True)
+
+
+# --- WARM-UP ---
+def warm_up():
+    """
+    Imports the analytics stack and runs a tiny fit + silhouette, so pandas/sklearn imports and
+    BLAS/OpenMP thread start-up happen before the first upload instead of during it.
+    """
+    import numpy as np
+    import pandas as pd  # noqa: F401
+    import pyarrow.parquet  # noqa: F401
+    from .model import KMeans, DEFAULT_K, score_clusters
+
+    X = np.random.default_rng(0).random((256, 3))
+    kmeans = KMeans(n_clusters=DEFAULT_K, random_state=42, n_init=1)
+    labels = kmeans.fit_predict(X)
+    score_clusters(X, labels, kmeans.cluster_centers_)
+    return os.getpid()
+
+
+async def warm_up_pool():
+    """
+    Runs warm_up on every pool worker. The pool starts workers on demand, so all the calls go
+    in at once; each takes long enough (the imports) that they land on different processes.
+    Returns how many distinct processes were warmed.
+    """
+    loop = asyncio.get_running_loop()
+    executor = await ensure_executor()
+    pids = await asyncio.gather(*(loop.run_in_executor(executor, warm_up) for _ in range(ANALYSIS_WORKERS)))
+    return len(set(pids))
+
+
+# --- UPLOAD SPOOLING ---
+async def spool_upload(file, directory=None):
+    """
+    Copies the upload to a temp file on disk (never whole into RAM) and returns its path.
+    `directory` overrides UPLOAD_SPOOL_DIR, e.g. to land job uploads on the job dir's filesystem.
+    """
+    directory = directory or UPLOAD_SPOOL_DIR
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=directory)
+    with os.fdopen(fd, "wb") as out:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, out, 1 << 20)
+    return path
+
+
+def discard_upload(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def expand_zip(path, max_files=None, max_bytes=None):
+    """
+    Spools every CSV inside a zip archive to its own temp file.
+    max_files / max_bytes are what's left of the request's budget: an archive that would go over
+    either is rejected (400) before anything is extracted.
+    Returns [(member filename, spooled path or None, error or None)]; raises ValueError for a bad archive.
+    """
+    max_files = BULK_MAX_FILES if max_files is None else max_files
+    max_bytes = BULK_MAX_UNPACKED_BYTES if max_bytes is None else max_bytes
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ValueError("Not a valid zip archive")
+    with archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        ]
+        if len(members) > max_files:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_FILES} files per request, zip members included")
+        # Only CSVs are extracted; file_size is also the most ZipFile will ever unpack for a member
+        if sum(info.file_size for info in members if _is_csv(info.filename)) > max_bytes:
+            raise HTTPException(status_code=400, detail=f"Zips unpack to more than {BULK_MAX_UNPACKED_BYTES} bytes in total")
+
+        entries = []
+        for info in members:
+            name = os.path.basename(info.filename)
+            if not _is_csv(name):
+                entries.append((name, None, "Only .csv files are analyzed"))
+                continue
+            fd, member_path = tempfile.mkstemp(suffix=".csv", dir=UPLOAD_SPOOL_DIR)
+            with os.fdopen(fd, "wb") as out, archive.open(info) as src:
+                shutil.copyfileobj(src, out, 1 << 20)
+            entries.append((name, member_path, None))
+        return entries
+
+
+def _is_csv(filename):
+    return filename.lower().endswith(".csv")
+
+
+# --- THE JOB THAT RUNS INSIDE THE WORKER ---
+def csv_read_options(path):
+    """
+    usecols + dtypes from the header line, so unused columns are never materialized. Metrics are
+    float32; ids are kept as strings, since 17-digit ad ids don't survive float64 (pandas' type for
+    an int column with gaps) and lose precision in JavaScript clients as JSON numbers.
+    """
+    # utf-8-sig drops the BOM Excel's "CSV UTF-8" export puts in front of the first column name
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f), [])
+    usecols = [c for c in header if c in METRIC_COLUMNS or c == "ad_id" or c.lower().endswith("_id")]
+    dtype = {c: "float32" if c in METRIC_COLUMNS else str for c in usecols}
+    return {"usecols": usecols, "dtype": dtype}
+
+
+def count_rows(source):
+    """Cheap newline count so we can pick an engine before parsing anything."""
+    lines = 0
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+    return lines
+
+
+def pick_engine(source):
+    if CLUSTER_ENGINE != "auto":
+        return CLUSTER_ENGINE
+    return "streaming" if count_rows(source) > STREAMING_ROW_THRESHOLD else "standard"
+
+
+def analyze_csv(source, results_path, auto_k=False, init_centroids=None):
+    """
+    Parse + cluster + savings. Lives at module level so the process pool can pickle it.
+    `source` is the path of the spooled CSV on disk.
+    The labeled rows are written to `results_path` (Parquet) so audits can be reopened.
+    auto_k searches the cluster count and init_centroids warm-starts the fit; only the standard
+    engine supports them (streaming always fits 3 clusters from scratch). Options that weren't
+    applied are listed in analysis["ignored_options"], by either engine.
+    """
+    import pandas as pd
+    from .model import run_clustering, run_clustering_streaming, savings_from_insights
+
+    read_options = csv_read_options(source)
+    timings = {}
+
+    if pick_engine(source) == "streaming":
+        with results_store.ResultWriter(results_path) as writer:
+            result = run_clustering_streaming(source, sink=writer.write, read_options=read_options, timings=timings)
+        if "error" in result:
+            if os.path.exists(results_path):
+                os.remove(results_path)
+            return {"error": result["error"], "timings": timings}
+        ignored = [name for name, asked in (("auto_k", auto_k), ("warm_start", init_centroids is not None)) if asked]
+        if ignored:
+            result["ignored_options"] = ignored
+    else:
+        if CSV_PARSER == "pyarrow":
+            read_options["engine"] = "pyarrow"
+        try:
+            with metrics.timed("read_csv", timings):
+                df = pd.read_csv(source, **read_options)
+        except ValueError as e:
+            # e.g. "$1" in a metric column can't be parsed as float32
+            return {"error": f"Could not parse the CSV: {e}", "timings": timings}
+        # Rows go to Parquet; responses read them back in whatever format the client asked for
+        result = run_clustering(df, include_rows=False, auto_k=auto_k, init_centroids=init_centroids, timings=timings)
+        if "error" in result:
+            return {"error": result["error"], "timings": timings}
+        if _timed_out(result):
+            # Not reproducible, so it must not replace the file other audits of this upload share
+            results_path = results_store.private_path(results_path)
+        with metrics.timed("write_results", timings):
+            results_store.write_frame(df, results_path)
+
+    # Spend and savings come straight from the per-group totals (float64), no extra pass over the rows
+    insights = result["group_insights"]
+    return {
+        # Centroids are stored per user for the next warm start, they're not part of the response
+        "centroids": result.pop("centroids"),
+        "analysis": result,
+        "total_spend": sum(info["total_spend"] for info in insights.values()),
+        "savings": float(savings_from_insights(insights)),
+        "results_path": results_path,
+        "timings": timings
+    }
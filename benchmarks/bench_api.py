@@ -0,0 +1,180 @@
+"""
+In-process API benchmark: drives app.main through TestClient against a throwaway SQLite
+database and reports throughput + latency percentiles for /login, /upload-logistics and /history,
+plus /history while --mixed-uploads fresh uploads are analyzed at once, and while --storm-logins
+logins (bcrypt) arrive together. /history should stay flat under both.
+
+    python -m benchmarks.bench_api --upload-rows 10000 --concurrency 4
+
+Everything (DB, job dir, Parquet results) lives in a temp dir; the repo's adoptimizer.db is never touched.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic import csv_bytes
+
+LOGIN_REQUESTS = 20
+UPLOAD_REQUESTS = 10
+HISTORY_REQUESTS = 200
+UPLOAD_ROWS = 10_000
+CONCURRENCY = 1
+# Mixed load: this many uploads in flight together while /history is sampled back to back
+MIXED_UPLOADS = 4
+# Login storm: this many logins fired together (bcrypt runs on its own bounded executor)
+STORM_LOGINS = 32
+
+
+def latency_stats(latencies, wall_seconds):
+    ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / wall_seconds,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _timed(call, i):
+    start = time.perf_counter()
+    response = call(i)
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.url} -> {response.status_code}: {response.text[:200]}")
+    return elapsed
+
+
+def drive(call, n_requests, concurrency):
+    """Runs call(i) n_requests times over `concurrency` threads; every response must be a 200."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda i: _timed(call, i), range(n_requests)))
+    return latency_stats(latencies, time.perf_counter() - start)
+
+
+def drive_during(background, n_background, probe):
+    """
+    Starts background(i) n_background times at once and calls probe(i) back to back until they
+    have all finished. Returns (background stats, probe stats); every response must be a 200.
+    """
+    start = time.perf_counter()
+    probe_latencies = []
+    with ThreadPoolExecutor(max_workers=n_background) as pool:
+        futures = [pool.submit(_timed, background, i) for i in range(n_background)]
+        while not all(future.done() for future in futures):
+            probe_latencies.append(_timed(probe, len(probe_latencies)))
+        background_latencies = [future.result() for future in futures]
+    wall = time.perf_counter() - start
+    return latency_stats(background_latencies, wall), latency_stats(probe_latencies, wall)
+
+
+def run(login_requests=LOGIN_REQUESTS, upload_requests=UPLOAD_REQUESTS, history_requests=HISTORY_REQUESTS,
+        upload_rows=UPLOAD_ROWS, concurrency=CONCURRENCY, mixed_uploads=MIXED_UPLOADS, storm_logins=STORM_LOGINS):
+    previous_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="adoptimizer-bench-")
+    os.chdir(workdir)  # the app's default DB / job / results paths are all relative
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # The benchmark logs in far more often than a real user may
+    os.environ.setdefault("LOGIN_MAX_ATTEMPTS", "1000000000")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    # Seeds the result cache hasn't seen: the mixed-load uploads must run the full analysis
+    uploads = [csv_bytes(upload_rows, seed=seed) for seed in range(upload_requests + 1 + mixed_uploads)]
+    results = {
+        "upload_rows": upload_rows, "concurrency": concurrency,
+        "mixed_uploads": mixed_uploads, "storm_logins": storm_logins
+    }
+
+    try:
+        _drive_endpoints(
+            TestClient(app), results, uploads, login_requests, upload_requests, history_requests, concurrency,
+            mixed_uploads, storm_logins
+        )
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _drive_endpoints(test_client, results, uploads, login_requests, upload_requests, history_requests, concurrency,
+                     mixed_uploads, storm_logins):
+    with test_client as client:
+        client.post("/signup", json={"username": "bench", "password": "bench-password"})
+
+        def login(_):
+            return client.post("/login", data={"username": "bench", "password": "bench-password"})
+
+        token = login(0).json()["access_token"]  # warm-up, also the token for everything below
+        headers = {"Authorization": f"Bearer {token}"}
+        results["login"] = drive(login, login_requests, concurrency)
+
+        def upload(i, data=None):
+            files = {"file": (f"bench_{i}.csv", data or uploads[i + 1], "text/csv")}
+            return client.post("/upload-logistics", files=files, headers=headers)
+
+        upload(0, uploads[0])  # starts the worker pool
+        results["upload"] = drive(upload, upload_requests, concurrency)
+        # Same bytes every time: the result-cache path
+        results["upload_cached"] = drive(lambda i: upload(i, uploads[0]), upload_requests, concurrency)
+
+        def history(_):
+            return client.get("/history", headers=headers)
+
+        history(0)
+        results["history"] = drive(history, history_requests, concurrency)
+
+        # Mixed load: /history p99 should stay close to the idle numbers above while the pool is busy
+        fresh = uploads[upload_requests + 1:]
+        results["mixed_upload"], results["history_during_uploads"] = drive_during(
+            lambda i: upload(i, fresh[i]), mixed_uploads, history
+        )
+
+        # Login storm: login throughput, and whether the hashing spills over into other endpoints
+        results["login_storm"], results["history_during_login_storm"] = drive_during(login, storm_logins, history)
+
+
+def print_report(results):
+    print(f"\nAPI ({results['upload_rows']:,}-row uploads, concurrency {results['concurrency']}, "
+          f"{results['mixed_uploads']} uploads in the mixed-load run, {results['storm_logins']} in the login storm)")
+    print(f"  {'endpoint':<28} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name in ("login", "upload", "upload_cached", "history", "mixed_upload", "history_during_uploads",
+                 "login_storm", "history_during_login_storm"):
+        s = results[name]
+        print(f"  {name:<28} {s['throughput_rps']:>8.1f} {s['p50_ms']:>8.1f} {s['p90_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['max_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--login-requests", type=int, default=LOGIN_REQUESTS)
+    parser.add_argument("--upload-requests", type=int, default=UPLOAD_REQUESTS)
+    parser.add_argument("--history-requests", type=int, default=HISTORY_REQUESTS)
+    parser.add_argument("--upload-rows", type=int, default=UPLOAD_ROWS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--mixed-uploads", type=int, default=MIXED_UPLOADS)
+    parser.add_argument("--storm-logins", type=int, default=STORM_LOGINS)
+    parser.add_argument("--out", help="also write the results as JSON here")
+    args = parser.parse_args()
+
+    results = run(
+        args.login_requests, args.upload_requests, args.history_requests, args.upload_rows, args.concurrency,
+        args.mixed_uploads, args.storm_logins
+    )
+    print_report(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"api": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Microbenchmark: group insights + savings, old per-cluster loop vs. the bincount pipeline.
+KMeans is left out (identical in both); labels are random so only the post-processing is timed.
+
+    python -m benchmarks.bench_insights
+"""
+import time
+import numpy as np
+import pandas as pd
+
+from app.model import prepare_features, group_sums, build_group_insights, savings_from_insights, classify_group
+
+ROW_COUNTS = (10_000, 100_000, 1_000_000)
+REPEATS = 5
+
+
+def make_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Impressions": rng.integers(0, 100_000, n_rows).astype("float32"),
+        "Clicks": rng.integers(0, 300, n_rows).astype("float32"),
+        "Spent": (rng.random(n_rows) * 500).astype("float32"),
+    })
+
+
+def legacy_pipeline(df, labels):
+    """The pre-vectorization code path: replace/fillna metrics, a copied X, a boolean mask per cluster, isin savings."""
+    df.columns = [c.replace('Spent', 'Spend') for c in df.columns]
+    df['CPC'] = df['Spend'] / df['Clicks'].replace(0, np.nan)
+    df['CPC'] = df['CPC'].fillna(0)
+    df['CTR'] = df['Clicks'] / df['Impressions'].replace(0, np.nan)
+    df['CTR'] = df['CTR'].fillna(0)
+    X = df[['Spend', 'CPC', 'CTR']].copy()  # noqa: F841 (the copy the old code made for KMeans)
+    df['ad_group'] = labels
+
+    group_insights = {}
+    overall_avg_cpc = df['CPC'].mean()
+    for cluster_id in sorted(df['ad_group'].unique()):
+        cluster_data = df[df['ad_group'] == cluster_id]
+        avg_cpc = cluster_data['CPC'].mean()
+        avg_ctr = cluster_data['CTR'].mean()
+        label, status, rec = classify_group(avg_cpc, avg_ctr, overall_avg_cpc, df['CTR'].mean())
+        group_insights[int(cluster_id)] = {"label": label, "status": status, "CPC": avg_cpc, "CTR": avg_ctr}
+
+    risky_ids = [gid for gid, info in group_insights.items() if info["status"] == "Risky"]
+    return df[df['ad_group'].isin(risky_ids)]['Spend'].sum()
+
+
+def vectorized_pipeline(df, labels):
+    prepare_features(df)
+    X = df[['Spend', 'CPC', 'CTR']].to_numpy()  # noqa: F841
+    df['ad_group'] = labels
+    insights = build_group_insights(
+        *group_sums(labels, 3, df['CPC'].to_numpy(), df['CTR'].to_numpy(), df['Spend'].to_numpy())
+    )
+    return savings_from_insights(insights)
+
+
+def best_of(fn, n_rows, labels):
+    timings = []
+    for _ in range(REPEATS):
+        df = make_frame(n_rows)
+        start = time.perf_counter()
+        fn(df, labels)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"{'rows':>10} {'legacy ms':>10} {'vectorized ms':>14} {'speedup':>8}")
+    for n_rows in ROW_COUNTS:
+        labels = np.random.default_rng(1).integers(0, 3, n_rows).astype(np.int32)
+        legacy = best_of(legacy_pipeline, n_rows, labels)
+        vectorized = best_of(vectorized_pipeline, n_rows, labels)
+        print(f"{n_rows:>10,} {legacy * 1000:>10.1f} {vectorized * 1000:>14.1f} {legacy / vectorized:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
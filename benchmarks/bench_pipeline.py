@@ -0,0 +1,164 @@
+"""
+Stage-by-stage timing + memory for the audit pipeline, mirroring workers.analyze_csv / model.run_clustering:
+read_csv -> prepare_features -> KMeans fit -> silhouette -> insights -> to_dict -> savings.
+
+    python -m benchmarks.bench_pipeline --sizes 1000 100000 1000000
+
+Timings are the best/median of --repeats clean runs; peak_mb comes from one extra run under
+tracemalloc (numpy and pandas buffers included), so tracing overhead never leaks into the timings.
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+
+import pandas as pd
+from sklearn.cluster import KMeans
+
+from app import model, workers
+from benchmarks.synthetic import csv_path
+
+SIZES = (1_000, 100_000, 1_000_000)
+REPEATS = 3
+FEATURES = ['Spend', 'CPC', 'CTR']
+
+
+def calculate_savings(results_df, group_insights):
+    """
+    The row-level savings pass the service used before savings_from_insights (kept here only as
+    the reference the per-group version is timed against).
+    """
+    risky_ids = [int(gid) for gid, info in group_insights.items() if info["status"] == "Risky"]
+    return results_df[results_df['ad_group'].isin(risky_ids)]['Spend'].astype('float64').sum()
+
+
+def pipeline_stages(path):
+    """Yields (stage name, callable) in order; each callable runs one stage on the shared state."""
+    state = {}
+
+    def read_csv():
+        state["df"] = pd.read_csv(path, **workers.csv_read_options(path))
+
+    def prepare():
+        model.prepare_features(state["df"])
+        state["X"] = state["df"][FEATURES].to_numpy()
+
+    def kmeans_fit():
+        state["kmeans"] = KMeans(n_clusters=model.DEFAULT_K, random_state=42, n_init=10)
+        state["labels"] = state["kmeans"].fit_predict(state["X"])
+        state["df"]["ad_group"] = state["labels"]
+
+    def silhouette():
+        model.score_clusters(state["X"], state["labels"], state["kmeans"].cluster_centers_)
+
+    def insights():
+        df = state["df"]
+        state["insights"] = model.build_group_insights(*model.group_sums(
+            state["labels"], model.DEFAULT_K, df['CPC'].to_numpy(), df['CTR'].to_numpy(), df['Spend'].to_numpy()
+        ))
+
+    def to_dict():
+        state["df"].to_dict('records')
+
+    def legacy_savings():
+        calculate_savings(state["df"], state["insights"])
+
+    def savings_from_insights():
+        model.savings_from_insights(state["insights"])
+
+    return [
+        ("read_csv", read_csv),
+        ("prepare_features", prepare),
+        ("kmeans_fit", kmeans_fit),
+        ("silhouette", silhouette),
+        ("insights", insights),
+        ("to_dict", to_dict),
+        ("calculate_savings", legacy_savings),
+        ("savings_from_insights", savings_from_insights),
+    ]
+
+
+def time_stages(path):
+    timings = {}
+    for name, stage in pipeline_stages(path):
+        start = time.perf_counter()
+        stage()
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def peak_memory_stages(path):
+    """Peak traced allocation (MB) per stage, measured from the stage's own starting point."""
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for name, stage in pipeline_stages(path):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            stage()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks[name] = (peak - before) / 2**20
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def time_end_to_end(path, repeats):
+    """run_clustering as the service calls it (rows go to Parquet, so no to_dict)."""
+    timings = []
+    for _ in range(repeats):
+        df = pd.read_csv(path, **workers.csv_read_options(path))
+        start = time.perf_counter()
+        model.run_clustering(df, include_rows=False)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(samples):
+    return {"min_s": min(samples), "median_s": statistics.median(samples), "runs": len(samples)}
+
+
+def bench_size(n_rows, repeats=REPEATS):
+    path = csv_path(n_rows)
+    runs = [time_stages(path) for _ in range(repeats)]
+    peaks = peak_memory_stages(path)
+    stages = {
+        name: {**summarize([run[name] for run in runs]), "peak_mb": peaks[name]}
+        for name in runs[0]
+    }
+    return {
+        "rows": n_rows,
+        "stages": stages,
+        "run_clustering": summarize(time_end_to_end(path, repeats)),
+    }
+
+
+def run(sizes=SIZES, repeats=REPEATS):
+    return [bench_size(n_rows, repeats) for n_rows in sizes]
+
+
+def print_report(results):
+    for result in results:
+        print(f"\n{result['rows']:,} rows (run_clustering total {result['run_clustering']['median_s'] * 1000:.1f} ms)")
+        print(f"  {'stage':<22} {'min ms':>10} {'median ms':>10} {'peak MB':>9}")
+        for name, stats in result["stages"].items():
+            print(f"  {name:<22} {stats['min_s'] * 1000:>10.1f} {stats['median_s'] * 1000:>10.1f} {stats['peak_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--out", help="also write the results as JSON here")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeats)
+    print_report(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"pipeline": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
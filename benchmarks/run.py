@@ -0,0 +1,120 @@
+"""
+Runs the pipeline + API benchmarks and writes one JSON file per run, so runs can be diffed.
+
+    python -m benchmarks.run                                  # full suite -> benchmarks/results/<commit>-<time>.json
+    python -m benchmarks.run --sizes 1000 100000 --skip-api   # quicker pipeline-only run
+    python -m benchmarks.run --compare benchmarks/results/old.json benchmarks/results/new.json
+
+Every result file records the commit, Python/library versions and CPU count next to the numbers;
+only compare runs from the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from benchmarks import bench_api, bench_pipeline
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+# Changes smaller than this (either way) are reported as noise by --compare
+NOISE_THRESHOLD = 0.10
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment():
+    import numpy, pandas, sklearn, fastapi, sqlalchemy
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {module.__name__: module.__version__ for module in (numpy, pandas, sklearn, fastapi, sqlalchemy)},
+    }
+
+
+def flatten(report):
+    """{metric path: value} for the numbers worth comparing (lower is better for all of them but req/s)."""
+    metrics = {}
+    for result in report.get("pipeline", []):
+        prefix = f"pipeline.{result['rows']}"
+        metrics[f"{prefix}.run_clustering.median_s"] = result["run_clustering"]["median_s"]
+        for stage, stats in result["stages"].items():
+            metrics[f"{prefix}.{stage}.median_s"] = stats["median_s"]
+            metrics[f"{prefix}.{stage}.peak_mb"] = stats["peak_mb"]
+    for endpoint, stats in report.get("api", {}).items():
+        if isinstance(stats, dict):
+            for key in ("throughput_rps", "p50_ms", "p99_ms"):
+                metrics[f"api.{endpoint}.{key}"] = stats[key]
+    return metrics
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    # Single-suite files (bench_pipeline/bench_api --out) carry no environment block
+    print(f"{old.get('environment', {}).get('commit', old_path)} -> {new.get('environment', {}).get('commit', new_path)}")
+    old_metrics, new_metrics = flatten(old), flatten(new)
+    for name in sorted(old_metrics.keys() & new_metrics.keys()):
+        before, after = old_metrics[name], new_metrics[name]
+        change = (after - before) / before if before else 0.0
+        better = change > 0 if name.endswith("throughput_rps") else change < 0
+        verdict = "~" if abs(change) < NOISE_THRESHOLD else ("better" if better else "WORSE")
+        print(f"  {name:<55} {before:>12.3f} {after:>12.3f} {change:>+8.1%}  {verdict}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(bench_pipeline.SIZES))
+    parser.add_argument("--repeats", type=int, default=bench_pipeline.REPEATS)
+    parser.add_argument("--upload-rows", type=int, default=bench_api.UPLOAD_ROWS)
+    parser.add_argument("--concurrency", type=int, default=bench_api.CONCURRENCY)
+    parser.add_argument("--mixed-uploads", type=int, default=bench_api.MIXED_UPLOADS)
+    parser.add_argument("--storm-logins", type=int, default=bench_api.STORM_LOGINS)
+    parser.add_argument("--skip-pipeline", action="store_true")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--out", help="result file (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {"environment": environment()}
+    if not args.skip_pipeline:
+        report["pipeline"] = bench_pipeline.run(args.sizes, args.repeats)
+        bench_pipeline.print_report(report["pipeline"])
+    if not args.skip_api:
+        report["api"] = bench_api.run(
+            upload_rows=args.upload_rows, concurrency=args.concurrency,
+            mixed_uploads=args.mixed_uploads, storm_logins=args.storm_logins
+        )
+        bench_api.print_report(report["api"])
+
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = os.path.join(RESULTS_DIR, f"{report['environment']['commit']}-{stamp}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nwrote {out}")
+
+
+if __name__ == "__main__":
+    main()
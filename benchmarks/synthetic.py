@@ -0,0 +1,47 @@
+"""
+Synthetic ad exports for the benchmarks: same columns as a real Facebook export
+(ad_id, campaign_id, Impressions, Clicks, Spent + a few text columns the parser skips).
+Files are cached by row count + seed, so repeated runs parse byte-identical input.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+SEED = 1234
+
+
+def make_ads_frame(n_rows, seed=SEED):
+    """Three loose populations (cheap, average, expensive ads) so KMeans has real structure to find."""
+    rng = np.random.default_rng(seed)
+    segment = rng.choice(3, size=n_rows, p=[0.5, 0.35, 0.15])
+    impressions = rng.lognormal(mean=(8.0, 9.0, 7.5), sigma=0.6, size=(n_rows, 3))[np.arange(n_rows), segment]
+    ctr = rng.beta(2, 200, n_rows) * np.array([1.5, 1.0, 0.4])[segment]
+    clicks = rng.binomial(impressions.astype(np.int64), np.minimum(ctr, 1))
+    cpc = rng.gamma(2.0, np.array([0.3, 0.8, 2.5])[segment])
+    spent = np.round(clicks * cpc + rng.random(n_rows), 2)
+    return pd.DataFrame({
+        "ad_id": np.arange(n_rows, dtype=np.int64) + 700000,
+        "campaign_id": rng.integers(900, 1200, n_rows),
+        "age": rng.choice(["18-24", "25-34", "35-44", "45-49"], n_rows),
+        "gender": rng.choice(["M", "F"], n_rows),
+        "Impressions": impressions.astype(np.int64),
+        "Clicks": clicks,
+        "Spent": spent,
+    })
+
+
+def csv_path(n_rows, seed=SEED, data_dir=DATA_DIR):
+    """Path of the cached CSV for n_rows, written on first use."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"ads_{n_rows}_{seed}.csv")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp"
+        make_ads_frame(n_rows, seed).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return path
+
+
+def csv_bytes(n_rows, seed=SEED):
+    """In-memory CSV for API benchmarks (a different seed gives a file the result cache hasn't seen)."""
+    return make_ads_frame(n_rows, seed).to_csv(index=False).encode()